@@ -0,0 +1,109 @@
+"""Reproducible synthetic image corpora for the conversion benchmarks.
+
+Images are drawn from gradients, a Mandelbrot texture and seeded shapes,
+so the same seed always produces the same pixels (and, for a given
+Pillow version, the same files) without shipping sample photos.
+"""
+import os
+import random
+from typing import List, NamedTuple, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+DEFAULT_SEED = 1234
+
+SIZES = {
+    'small': (640, 480),
+    'medium': (1920, 1080),
+    'large': (6000, 4000),
+}
+
+
+class CorpusImage(NamedTuple):
+    name: str
+    size: Tuple[int, int]
+    format: str  # Pillow format name
+    mode: str
+
+    @property
+    def filename(self) -> str:
+        ext = {'JPEG': 'jpg', 'TIFF': 'tiff'}.get(self.format, self.format.lower())
+        return f"{self.name}.{ext}"
+
+    @property
+    def megapixels(self) -> float:
+        return self.size[0] * self.size[1] / 1e6
+
+
+def corpus_spec(sizes=('small', 'medium', 'large')) -> List[CorpusImage]:
+    """The formats and modes a watch folder typically receives, at each size"""
+    variants = [
+        ('JPEG', 'RGB'),
+        ('JPEG', 'L'),
+        ('PNG', 'RGB'),
+        ('PNG', 'RGBA'),
+        ('PNG', 'P'),
+        ('WEBP', 'RGB'),
+        ('TIFF', 'RGB'),
+    ]
+    spec = []
+    for size_name in sizes:
+        for image_format, mode in variants:
+            name = f"{size_name}_{image_format.lower()}_{mode.lower()}"
+            spec.append(CorpusImage(name, SIZES[size_name], image_format, mode))
+    return spec
+
+
+def synthetic_image(size: Tuple[int, int], mode: str, seed: int) -> Image.Image:
+    """Photo-like test content: smooth gradients, fine texture and hard edges"""
+    rng = random.Random(f"{seed}:{size}:{mode}")
+    width, height = size
+
+    # Smooth areas from gradients, detail from a Mandelbrot crop
+    red = Image.linear_gradient('L').rotate(rng.uniform(0, 360)).resize(size)
+    green = Image.radial_gradient('L').resize(size)
+    cx, cy, span = rng.uniform(-0.8, -0.7), rng.uniform(0.1, 0.2), rng.uniform(0.05, 0.2)
+    blue = Image.effect_mandelbrot(
+        (max(width // 4, 1), max(height // 4, 1)),
+        (cx - span, cy - span, cx + span, cy + span),
+        rng.randint(64, 200)
+    ).resize(size, Image.BICUBIC)
+    img = Image.merge('RGB', (red, green, blue))
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4 + 1), y0 + rng.randrange(height // 4 + 1)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=colour)
+        else:
+            draw.rectangle((x0, y0, x1, y1), outline=colour, width=rng.randint(1, 8))
+    img = img.filter(ImageFilter.GaussianBlur(rng.uniform(0.5, 1.5)))
+
+    if mode == 'RGBA':
+        alpha = Image.radial_gradient('L').resize(size)
+        img.putalpha(alpha)
+    elif mode == 'P':
+        img = img.quantize(256)
+    elif mode != 'RGB':
+        img = img.convert(mode)
+    return img
+
+
+def build_corpus(directory: str, spec: List[CorpusImage], seed: int = DEFAULT_SEED) -> List[str]:
+    """Write any corpus images missing from directory and return all their paths"""
+    directory = os.path.join(directory, f"seed-{seed}")
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for item in spec:
+        path = os.path.join(directory, item.filename)
+        if not os.path.exists(path):
+            img = synthetic_image(item.size, item.mode, seed)
+            options = {'quality': 90} if item.format in ('JPEG', 'WEBP') else {}
+            temp_path = f"{path}.tmp"
+            img.save(temp_path, format=item.format, **options)
+            os.replace(temp_path, path)
+        paths.append(path)
+    return paths
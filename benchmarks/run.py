@@ -0,0 +1,269 @@
+"""Conversion benchmarks over a synthetic corpus.
+
+Runs ImageProcessor.process_image and save_image for a set of
+representative profiles over generated images of several sizes, formats
+and modes, and writes throughput and latency percentiles per conversion
+stage (as timed by utils.metrics) and peak RSS to a JSON file:
+
+    python -m benchmarks.run [--output results.json] [--repeats N]
+                             [--sizes small,medium,large] [--profile NAME ...]
+                             [--baseline OLD.json [--tolerance 0.15]]
+
+Each profile runs in its own process so its peak RSS is not inflated by
+the profiles before it. The corpus is cached under --corpus-dir and is
+identical for a given --seed. With --baseline, stages whose p50 latency
+grew by more than the tolerance are listed and the exit status is 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import PIL
+from PIL import Image
+
+from benchmarks.corpus import DEFAULT_SEED, SIZES, build_corpus, corpus_spec
+from utils import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Conversion stages timed by utils.metrics; a stage a profile skips is left out
+STAGES = ('decode', 'resize', 'crop', 'enhance', 'encode', 'total')
+PERCENTILES = (50, 90, 99)
+
+# Settings of a newly created profile; PROFILES override what they use
+BASE_PROFILE = {
+    'resize_width': 0, 'resize_height': 0, 'decode_mode': 'Quality',
+    'crop_left': 0, 'crop_top': 0, 'crop_right': 0, 'crop_bottom': 0,
+    'brightness': 1.0, 'contrast': 1.0, 'sharpness': 1.0, 'saturation': 1.0,
+    'quality': 85,
+}
+
+# Common profile shapes: thumbnails, web downsizing, cropped fixed sizes,
+# lossless re-encodes with enhancements, and icons. A resize_width of -1
+# means a percentage resize by resize_height, as in the profile editor.
+PROFILES = [
+    dict(BASE_PROFILE, id=1, name='thumbnail_webp', resize_width=320, resize_height=240,
+         output_format='WEBP', quality=80),
+    dict(BASE_PROFILE, id=2, name='half_jpg', resize_width=-1, resize_height=50,
+         output_format='JPG'),
+    dict(BASE_PROFILE, id=3, name='crop_resize_jpg', resize_width=1600, resize_height=900,
+         crop_left=100, crop_top=50, crop_right=1500, crop_bottom=850,
+         output_format='JPG', quality=90),
+    dict(BASE_PROFILE, id=4, name='enhance_png', brightness=1.1, contrast=1.2,
+         saturation=1.1, sharpness=1.5, output_format='PNG', quality=80),
+    dict(BASE_PROFILE, id=5, name='fast_preview_jpg', resize_width=-1, resize_height=25,
+         decode_mode='Fast', output_format='JPG', quality=75),
+    dict(BASE_PROFILE, id=6, name='icon_ico', resize_width=64, resize_height=64,
+         output_format='ICO', quality=100),
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linearly interpolated percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies: List[float], megapixels: float) -> Dict[str, Any]:
+    """Throughput and latency figures for one stage (latencies in seconds)"""
+    elapsed = sum(latencies)
+    summary = {
+        'count': len(latencies),
+        'images_per_s': round(len(latencies) / elapsed, 3) if elapsed else None,
+        'megapixels_per_s': round(megapixels / elapsed, 3) if elapsed else None,
+        'mean_ms': round(elapsed / len(latencies) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = round(percentile(latencies, pct) * 1000, 3)
+    return summary
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / scale, 1)
+
+
+def run_profile(profile: Dict[str, Any], paths: List[str], repeats: int) -> Dict[str, Any]:
+    """Time every corpus image through one profile. Runs in a fresh worker process."""
+    from utils.image_processor import ImageProcessor
+
+    output_dir = tempfile.mkdtemp(prefix='tbice-bench-')
+    profile = dict(profile, destination_folder=output_dir, filename_pattern='{name}')
+    processor = ImageProcessor(profile)
+
+    latencies = {stage: [] for stage in STAGES}
+    megapixels = dict.fromkeys(STAGES, 0.0)
+    per_image = {}
+    failures = []
+    try:
+        for path in paths:
+            with Image.open(path) as img:
+                source_mp = img.width * img.height / 1e6
+            name = os.path.splitext(os.path.basename(path))[0]
+            image_totals = []
+
+            # One untimed pass warms the codecs and the OS file cache
+            for attempt in range(repeats + 1):
+                timings = metrics.start_timing()
+                start = time.perf_counter()
+                try:
+                    img = processor.process_image(path)
+                    dest_path = processor.save_image(img, path) if img is not None else None
+                finally:
+                    metrics.stop_timing()
+                timings['total'] = time.perf_counter() - start
+                if dest_path is None:
+                    failures.append(name)
+                    break
+                if attempt == 0:
+                    continue
+
+                for stage in STAGES:
+                    if stage in timings:
+                        latencies[stage].append(timings[stage])
+                        megapixels[stage] += source_mp
+                image_totals.append(timings['total'])
+
+            if image_totals:
+                per_image[name] = {
+                    'megapixels': round(source_mp, 3),
+                    'p50_ms': round(percentile(image_totals, 50) * 1000, 3),
+                }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        'profile': profile['name'],
+        'stages': {stage: summarize(values, megapixels[stage])
+                   for stage, values in latencies.items() if values},
+        'images': per_image,
+        'failures': failures,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe stages whose p50 latency regressed by more than tolerance against baseline"""
+    previous = {entry['profile']: entry for entry in baseline.get('results', [])}
+    regressions = []
+    for entry in results['results']:
+        old = previous.get(entry['profile'])
+        if not old:
+            continue
+        for stage, stats in entry['stages'].items():
+            old_p50 = old['stages'].get(stage, {}).get('p50_ms')
+            if old_p50 and stats['p50_ms'] > old_p50 * (1 + tolerance):
+                regressions.append(
+                    f"{entry['profile']} {stage}: p50 {old_p50:.1f} ms -> {stats['p50_ms']:.1f} ms "
+                    f"(+{(stats['p50_ms'] / old_p50 - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark TBICE conversion profiles on a synthetic corpus")
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help="JSON file to write results to (default: %(default)s)")
+    parser.add_argument('--corpus-dir', default=os.path.join(tempfile.gettempdir(), 'tbice-bench-corpus'),
+                        help="Where generated images are cached (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help="Corpus seed; the same seed always gives the same images")
+    parser.add_argument('--sizes', default='small,medium,large',
+                        help=f"Comma-separated image sizes to include, from: {', '.join(SIZES)}")
+    parser.add_argument('--repeats', type=int, default=3,
+                        help="Timed runs per image and profile (default: %(default)s)")
+    parser.add_argument('--profile', action='append', dest='profiles', metavar='NAME',
+                        help="Only run this profile (repeatable). Available: "
+                             + ', '.join(profile['name'] for profile in PROFILES))
+    parser.add_argument('--baseline', help="Earlier results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="Allowed p50 slowdown against --baseline, as a fraction (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"Unknown size(s): {', '.join(unknown)}")
+
+    profiles = PROFILES
+    if args.profiles:
+        profiles = [profile for profile in PROFILES if profile['name'] in args.profiles]
+        missing = set(args.profiles) - {profile['name'] for profile in profiles}
+        if missing:
+            parser.error(f"Unknown profile(s): {', '.join(sorted(missing))}")
+
+    spec = corpus_spec(sizes)
+    print(f"Preparing corpus of {len(spec)} images in {args.corpus_dir}...")
+    paths = build_corpus(args.corpus_dir, spec, args.seed)
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'seed': args.seed,
+            'sizes': sizes,
+            'repeats': args.repeats,
+            'images': [item._asdict() for item in spec],
+        },
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': [],
+    }
+
+    context = multiprocessing.get_context('spawn')
+    for profile in profiles:
+        print(f"Running {profile['name']}...", flush=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            entry = executor.submit(run_profile, profile, paths, args.repeats).result()
+        results['results'].append(entry)
+
+        total = entry['stages'].get('total')
+        if total:
+            print(f"  {total['images_per_s']:.2f} images/s, p50 {total['p50_ms']:.1f} ms, "
+                  f"p99 {total['p99_ms']:.1f} ms, peak RSS {entry['peak_rss_mb']} MB")
+        if entry['failures']:
+            print(f"  Failed: {', '.join(entry['failures'])}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != results['config']:
+            print("Note: the baseline used a different corpus or repeat count")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
 from .db_manager import Database
+from .history_writer import HistoryWriter
 
-__all__ = ['Database']
\ No newline at end of file
+__all__ = ['Database', 'HistoryWriter']
\ No newline at end of file
@@ -3,11 +3,21 @@ from datetime import datetime
 from typing import Dict, List, Optional, Any
 
 class Database:
-    def __init__(self, db_path: str = "image_converter.db"):
+    def __init__(self, db_path: str = "image_converter.db", read_only: bool = False):
         self.db_path = db_path  # Store the database path for thread safety
+        if read_only:
+            # Lookup-only connection for conversion workers; never creates or migrates
+            self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            self.cursor = self.conn.cursor()
+            return
+        
         self.conn = sqlite3.connect(db_path)
         self.cursor = self.conn.cursor()
         self.cursor.execute("PRAGMA foreign_keys=ON")
+        # WAL lets the watcher and GUI read while the history writer commits;
+        # NORMAL only fsyncs at checkpoints, which is safe in WAL mode
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute("PRAGMA synchronous=NORMAL")
         self.create_tables()
     
     def create_tables(self):
@@ -21,6 +31,10 @@ class Database:
             output_format TEXT,
             filename_pattern TEXT,
             is_active INTEGER,
+            conversion_engine TEXT DEFAULT 'Thread',
+            duplicate_mode TEXT DEFAULT 'Off',
+            priority INTEGER DEFAULT 1,
+            sequence_counter INTEGER DEFAULT 0,
             created_at TIMESTAMP,
             updated_at TIMESTAMP
         )
@@ -35,6 +49,7 @@ class Database:
             resize_height INTEGER,
             resize_method TEXT DEFAULT 'Dimensions',
             keep_aspect_ratio INTEGER DEFAULT 0,
+            decode_mode TEXT DEFAULT 'Quality',
             crop_left INTEGER,
             crop_top INTEGER,
             crop_right INTEGER,
@@ -55,13 +70,68 @@ class Database:
             profile_id INTEGER,
             source_path TEXT,
             destination_path TEXT,
+            content_hash TEXT,
             processed_at TIMESTAMP,
             FOREIGN KEY (profile_id) REFERENCES profiles (id) ON DELETE CASCADE
         )
         ''')
         
+        # Application settings table (simple key/value store)
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        
+        self.migrate_schema()
+        
         self.conn.commit()
     
+    def migrate_schema(self):
+        """Bring databases created by older versions up to the current schema"""
+        self.add_column_if_missing('profiles', 'conversion_engine', "TEXT DEFAULT 'Thread'")
+        self.add_column_if_missing('image_settings', 'decode_mode', "TEXT DEFAULT 'Quality'")
+        self.add_column_if_missing('profiles', 'duplicate_mode', "TEXT DEFAULT 'Off'")
+        self.add_column_if_missing('processed_files', 'content_hash', "TEXT")
+        self.add_column_if_missing('profiles', 'priority', "INTEGER DEFAULT 1")
+        
+        if self.add_column_if_missing('profiles', 'sequence_counter', "INTEGER DEFAULT 0"):
+            # Continue numbering after the files each profile has already produced
+            self.cursor.execute('''
+            UPDATE profiles SET sequence_counter = (
+                SELECT COUNT(*) FROM processed_files WHERE processed_files.profile_id = profiles.id
+            )
+            ''')
+        
+        self.cursor.execute('''
+        SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_processed_files_profile_source'
+        ''')
+        if not self.cursor.fetchone():
+            # Older versions could record a file more than once; keep the latest row
+            self.cursor.execute('''
+            DELETE FROM processed_files WHERE id NOT IN (
+                SELECT MAX(id) FROM processed_files GROUP BY profile_id, source_path
+            )
+            ''')
+            self.cursor.execute('''
+            CREATE UNIQUE INDEX idx_processed_files_profile_source
+            ON processed_files (profile_id, source_path)
+            ''')
+        
+        self.cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_processed_files_profile_hash
+        ON processed_files (profile_id, content_hash)
+        ''')
+    
+    def add_column_if_missing(self, table, column, definition):
+        """Add a column to an existing table, returning True if it was missing"""
+        self.cursor.execute(f"PRAGMA table_info({table})")
+        if column in [row[1] for row in self.cursor.fetchall()]:
+            return False
+        self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    
     def save_profile(self, profile_data, settings_data):
         current_time = datetime.now()
         
@@ -75,7 +145,8 @@ class Database:
             self.cursor.execute('''
             UPDATE profiles 
             SET source_folder = ?, destination_folder = ?, output_format = ?,
-                filename_pattern = ?, is_active = ?, updated_at = ?
+                filename_pattern = ?, is_active = ?, conversion_engine = ?, duplicate_mode = ?,
+                priority = ?, updated_at = ?
             WHERE id = ?
             ''', (
                 profile_data['source_folder'],
@@ -83,6 +154,9 @@ class Database:
                 profile_data['output_format'],
                 profile_data['filename_pattern'],
                 profile_data['is_active'],
+                profile_data.get('conversion_engine', 'Thread'),
+                profile_data.get('duplicate_mode', 'Off'),
+                profile_data.get('priority', 1),
                 current_time,
                 profile_id
             ))
@@ -91,7 +165,7 @@ class Database:
             self.cursor.execute('''
             UPDATE image_settings
             SET resize_width = ?, resize_height = ?, resize_method = ?, keep_aspect_ratio = ?,
-                crop_left = ?, crop_top = ?, crop_right = ?, crop_bottom = ?,
+                decode_mode = ?, crop_left = ?, crop_top = ?, crop_right = ?, crop_bottom = ?,
                 brightness = ?, contrast = ?, sharpness = ?, saturation = ?,
                 quality = ?
             WHERE profile_id = ?
@@ -100,6 +174,7 @@ class Database:
                 settings_data['resize_height'],
                 settings_data.get('resize_method', 'Dimensions'),
                 settings_data.get('keep_aspect_ratio', 0),
+                settings_data.get('decode_mode', 'Quality'),
                 settings_data['crop_left'],
                 settings_data['crop_top'],
                 settings_data['crop_right'],
@@ -116,8 +191,9 @@ class Database:
             self.cursor.execute('''
             INSERT INTO profiles (
                 name, source_folder, destination_folder, output_format,
-                filename_pattern, is_active, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                filename_pattern, is_active, conversion_engine, duplicate_mode, priority,
+                created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 profile_data['name'],
                 profile_data['source_folder'],
@@ -125,6 +201,9 @@ class Database:
                 profile_data['output_format'],
                 profile_data['filename_pattern'],
                 profile_data['is_active'],
+                profile_data.get('conversion_engine', 'Thread'),
+                profile_data.get('duplicate_mode', 'Off'),
+                profile_data.get('priority', 1),
                 current_time,
                 current_time
             ))
@@ -135,16 +214,17 @@ class Database:
             self.cursor.execute('''
             INSERT INTO image_settings (
                 profile_id, resize_width, resize_height, resize_method, keep_aspect_ratio,
-                crop_left, crop_top, crop_right, crop_bottom,
+                decode_mode, crop_left, crop_top, crop_right, crop_bottom,
                 brightness, contrast, sharpness, saturation, 
                 quality
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 profile_id,
                 settings_data['resize_width'],
                 settings_data['resize_height'],
                 settings_data.get('resize_method', 'Dimensions'),
                 settings_data.get('keep_aspect_ratio', 0),
+                settings_data.get('decode_mode', 'Quality'),
                 settings_data['crop_left'],
                 settings_data['crop_top'],
                 settings_data['crop_right'],
@@ -162,9 +242,10 @@ class Database:
     def get_profiles(self):
         self.cursor.execute('''
         SELECT p.id, p.name, p.source_folder, p.destination_folder, 
-               p.output_format, p.filename_pattern, p.is_active,
+               p.output_format, p.filename_pattern, p.is_active, p.conversion_engine,
+               p.duplicate_mode, p.priority,
                s.resize_width, s.resize_height, s.resize_method, s.keep_aspect_ratio,
-               s.crop_left, s.crop_top, s.crop_right, s.crop_bottom,
+               s.decode_mode, s.crop_left, s.crop_top, s.crop_right, s.crop_bottom,
                s.brightness, s.contrast, s.sharpness, s.saturation, s.quality
         FROM profiles p
         JOIN image_settings s ON p.id = s.profile_id
@@ -173,9 +254,10 @@ class Database:
         
         columns = [
             'id', 'name', 'source_folder', 'destination_folder', 
-            'output_format', 'filename_pattern', 'is_active',
+            'output_format', 'filename_pattern', 'is_active', 'conversion_engine',
+            'duplicate_mode', 'priority',
             'resize_width', 'resize_height', 'resize_method', 'keep_aspect_ratio',
-            'crop_left', 'crop_top', 'crop_right', 'crop_bottom',
+            'decode_mode', 'crop_left', 'crop_top', 'crop_right', 'crop_bottom',
             'brightness', 'contrast', 'sharpness', 'saturation', 'quality'
         ]
         
@@ -184,9 +266,10 @@ class Database:
     def get_profile(self, profile_id):
         self.cursor.execute('''
         SELECT p.id, p.name, p.source_folder, p.destination_folder, 
-               p.output_format, p.filename_pattern, p.is_active,
+               p.output_format, p.filename_pattern, p.is_active, p.conversion_engine,
+               p.duplicate_mode, p.priority,
                s.resize_width, s.resize_height, s.resize_method, s.keep_aspect_ratio,
-               s.crop_left, s.crop_top, s.crop_right, s.crop_bottom,
+               s.decode_mode, s.crop_left, s.crop_top, s.crop_right, s.crop_bottom,
                s.brightness, s.contrast, s.sharpness, s.saturation, s.quality
         FROM profiles p
         JOIN image_settings s ON p.id = s.profile_id
@@ -199,9 +282,10 @@ class Database:
             
         columns = [
             'id', 'name', 'source_folder', 'destination_folder', 
-            'output_format', 'filename_pattern', 'is_active',
+            'output_format', 'filename_pattern', 'is_active', 'conversion_engine',
+            'duplicate_mode', 'priority',
             'resize_width', 'resize_height', 'resize_method', 'keep_aspect_ratio',
-            'crop_left', 'crop_top', 'crop_right', 'crop_bottom',
+            'decode_mode', 'crop_left', 'crop_top', 'crop_right', 'crop_bottom',
             'brightness', 'contrast', 'sharpness', 'saturation', 'quality'
         ]
         
@@ -218,13 +302,73 @@ class Database:
         self.cursor.execute("DELETE FROM profiles WHERE id = ?", (profile_id,))
         self.conn.commit()
     
-    def log_processed_file(self, profile_id, source_path, destination_path):
+    def allocate_sequence(self, profile_id, count=1):
+        """Reserve count consecutive {seq} numbers for a profile and return the first.
+
+        The increment and read happen in one write transaction, so numbers are
+        never handed out twice, even to other connections or processes.
+        """
+        try:
+            self.cursor.execute('''
+            UPDATE profiles SET sequence_counter = sequence_counter + ?
+            WHERE id = ?
+            ''', (count, profile_id))
+            self.cursor.execute("SELECT sequence_counter FROM profiles WHERE id = ?", (profile_id,))
+            row = self.cursor.fetchone()
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        
+        if not row:
+            return 0
+        return row[0] - count + 1
+    
+    def log_processed_file(self, profile_id, source_path, destination_path, content_hash=None):
         self.cursor.execute('''
-        INSERT INTO processed_files (profile_id, source_path, destination_path, processed_at)
-        VALUES (?, ?, ?, ?)
-        ''', (profile_id, source_path, destination_path, datetime.now()))
+        INSERT INTO processed_files (profile_id, source_path, destination_path, content_hash, processed_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (profile_id, source_path) DO UPDATE SET
+            destination_path = excluded.destination_path,
+            content_hash = excluded.content_hash,
+            processed_at = excluded.processed_at
+        ''', (profile_id, source_path, destination_path, content_hash, datetime.now()))
         self.conn.commit()
     
+    def log_processed_files(self, records):
+        """Record many (profile_id, source_path, destination_path, content_hash) rows in one transaction"""
+        current_time = datetime.now()
+        try:
+            self.cursor.executemany('''
+            INSERT INTO processed_files (profile_id, source_path, destination_path, content_hash, processed_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (profile_id, source_path) DO UPDATE SET
+                destination_path = excluded.destination_path,
+                content_hash = excluded.content_hash,
+                processed_at = excluded.processed_at
+            ''', [(profile_id, source_path, destination_path, content_hash, current_time)
+                  for profile_id, source_path, destination_path, content_hash in records])
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+    
+    def is_processed(self, profile_id, source_path):
+        """Check whether a file has been processed by a profile (indexed lookup)"""
+        self.cursor.execute('''
+        SELECT 1 FROM processed_files WHERE profile_id = ? AND source_path = ?
+        ''', (profile_id, source_path))
+        return self.cursor.fetchone() is not None
+    
+    def find_processed_outputs(self, profile_id, content_hash):
+        """Destination paths already produced by a profile from a source with this content hash"""
+        self.cursor.execute('''
+        SELECT destination_path FROM processed_files
+        WHERE profile_id = ? AND content_hash = ? AND destination_path IS NOT NULL
+        ORDER BY id DESC
+        ''', (profile_id, content_hash))
+        return [row[0] for row in self.cursor.fetchall()]
+    
     def get_processed_files_count(self, profile_id=None):
         if profile_id:
             self.cursor.execute('''
@@ -250,6 +394,21 @@ class Database:
         
         return [row[0] for row in self.cursor.fetchall()]
     
+    def iter_processed_files(self):
+        """Yield (profile_id, source_path) for every processed file without loading them all"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute('''
+            SELECT profile_id, source_path FROM processed_files
+            ''')
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+    
     def clear_processed_files(self, profile_id=None):
         if profile_id:
             self.cursor.execute('''
@@ -263,5 +422,17 @@ class Database:
         self.conn.commit()
         return self.cursor.rowcount
     
+    def get_setting(self, key, default=None):
+        """Get an application setting, returning default if it has not been set"""
+        self.cursor.execute("SELECT value FROM app_settings WHERE key = ?", (key,))
+        row = self.cursor.fetchone()
+        return row[0] if row else default
+    
+    def set_setting(self, key, value):
+        self.cursor.execute('''
+        INSERT OR REPLACE INTO app_settings (key, value) VALUES (?, ?)
+        ''', (key, str(value)))
+        self.conn.commit()
+    
     def close(self):
         self.conn.close()
\ No newline at end of file
@@ -0,0 +1,110 @@
+import time
+import queue
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from .db_manager import Database
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 0.5  # seconds
+WRITE_ATTEMPTS = 4  # tries per batch, e.g. while another process holds the database lock
+RETRY_DELAY = 0.5  # seconds before the first retry, doubled for each one after
+
+
+class HistoryWriter(threading.Thread):
+    """Write-behind writer for the processed_files history.
+
+    Conversions report their results with log(); a single background thread
+    owns its own connection and commits them in batches, flushing when
+    batch_size records are waiting or flush_interval seconds have passed
+    since the oldest one arrived. on_flush is called from the writer thread
+    with the list of (profile_id, source_path, destination_path,
+    content_hash) records once they are committed. A batch that still
+    cannot be written after WRITE_ATTEMPTS tries is passed to on_error
+    instead, with the error message. If metrics is set, the time each
+    batch takes to commit is recorded with its record_db_write().
+    """
+
+    def __init__(self, db_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 on_flush: Optional[Callable[[List[Tuple[int, str, str, Optional[str]]]], None]] = None,
+                 metrics=None,
+                 on_error: Optional[Callable[[List[Tuple[int, str, str, Optional[str]]], str], None]] = None):
+        super().__init__(name="tbice-history-writer", daemon=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.on_error = on_error
+        self.metrics = metrics
+        self.queue = queue.Queue()
+        self._stop_marker = object()
+
+    def log(self, profile_id: int, source_path: str, destination_path: str,
+            content_hash: Optional[str] = None):
+        self.queue.put((profile_id, source_path, destination_path, content_hash))
+
+    def stop(self):
+        """Write everything still queued, then end the thread"""
+        self.queue.put(self._stop_marker)
+        self.join()
+
+    def run(self):
+        db = Database(self.db_path)
+        batch = []
+        deadline = None
+        stopping = False
+
+        try:
+            while not stopping:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is self._stop_marker:
+                    stopping = True
+                elif item is not None:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                if batch and (stopping or len(batch) >= self.batch_size
+                              or time.monotonic() >= deadline):
+                    self.flush(db, batch)
+                    batch = []
+                    deadline = None
+        finally:
+            db.close()
+
+    def flush(self, db: Database, batch):
+        start = time.perf_counter()
+        delay = RETRY_DELAY
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                db.log_processed_files(batch)
+                break
+            except Exception as e:
+                print(f"Error writing processed files history: {e}")
+                error = str(e)
+            if attempt < WRITE_ATTEMPTS - 1:
+                time.sleep(delay)
+                delay *= 2
+        else:
+            if self.on_error:
+                try:
+                    self.on_error(batch, error)
+                except Exception as e:
+                    print(f"Error reporting unwritten history: {e}")
+            return
+
+        metrics = self.metrics
+        if metrics:
+            metrics.record_db_write(time.perf_counter() - start, len(batch))
+
+        if self.on_flush:
+            try:
+                self.on_flush(batch)
+            except Exception as e:
+                print(f"Error reporting flushed history: {e}")
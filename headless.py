@@ -0,0 +1,296 @@
+"""Run TBICE conversion profiles without the GUI.
+
+Loads profiles from the same database as the desktop app, watches the
+source folders of the active ones and converts new files on the worker
+pool. PyQt6 is never imported, so this runs on servers without a display.
+
+    python headless.py [--db image_converter.db] [--profile NAME ...]
+                       [--workers N] [--log-file PATH]
+                       [--metrics-port PORT] [--metrics-file PATH]
+                       [--backfill [--recursive]]
+
+Send SIGHUP to reload profiles and settings; SIGINT or SIGTERM to stop.
+
+With --backfill, the images already in the source folders are converted
+in bulk instead, and the runner exits once they are done.
+"""
+import sys
+import signal
+import logging
+import argparse
+import multiprocessing
+
+from database.db_manager import Database
+from database.history_writer import HistoryWriter
+from utils.backfill import Backfill, format_duration
+from utils.admission import memory_budget
+from utils.conversion_pool import ConversionPool
+from utils.image_processor import ImageProcessor
+from utils.metrics import MetricsExporter, get_metrics, metrics_config
+from utils.output_cache import output_cache_config
+from utils.profiling import profiling_config, stop_tracing
+from utils.seen_index import SeenFileIndex
+from utils.tiling import job_memory_limit
+from utils.watch_loop import WatchLoop
+
+logger = logging.getLogger("tbice")
+
+
+class HeadlessRunner:
+    """Wires the watch loop, conversion pool and history writer together without Qt"""
+
+    def __init__(self, db: Database, profile_names=None, workers=None, metrics_export=None):
+        self.db = db
+        # (port, textfile) from the command line, overriding the app settings
+        self.metrics_export = metrics_export
+        self.metrics_exporter = None
+        self.loop = WatchLoop(db, on_file=self.process_file, profile_names=profile_names)
+        self.loop.on_pass = self.reload_if_requested
+        self.reload_requested = False
+        self.conversion_pool = ConversionPool(
+            max_workers=workers or int(db.get_setting('worker_count', 0)),
+            on_result=self.on_conversion_finished,
+            db_path=db.db_path,
+            output_cache=output_cache_config(db),
+            profiling=profiling_config(db),
+            memory_limit=job_memory_limit(db),
+            memory_budget=memory_budget(db)
+        )
+        self.history_writer = HistoryWriter(db.db_path, on_flush=self.on_history_flushed,
+                                            on_error=self.on_history_failed)
+        self.apply_metrics_settings()
+
+    def run(self):
+        """Watch and convert until stop() is called"""
+        if not self.loop.profiles:
+            logger.warning("No active profiles to watch")
+        for profile in self.loop.profiles.values():
+            logger.info("Watching %s for profile %s", profile['source_folder'], profile['name'])
+
+        self.history_writer.start()
+        self.conversion_pool.start()
+        try:
+            self.loop.run()
+        finally:
+            # Drop queued conversions, finish running ones and record them
+            self.conversion_pool.shutdown(wait=True, cancel_pending=True)
+            self.history_writer.stop()
+            if self.metrics_exporter:
+                self.metrics_exporter.stop()
+            logger.info("Stopped")
+
+    def stop(self):
+        self.loop.stop()
+
+    def request_reload(self):
+        """Safe from a signal handler: the reload runs on the loop's next pass"""
+        self.reload_requested = True
+
+    def reload_if_requested(self):
+        if self.reload_requested:
+            self.reload_requested = False
+            self.reload()
+
+    def reload(self):
+        self.loop.reload_profiles()
+        self.loop.request_rescan()
+        self.conversion_pool.output_cache = output_cache_config(self.db)
+        self.conversion_pool.profiling = profiling_config(self.db)
+        self.conversion_pool.memory_limit = job_memory_limit(self.db)
+        self.conversion_pool.set_memory_budget(memory_budget(self.db))
+        if not self.conversion_pool.profiling:
+            stop_tracing()
+        self.apply_metrics_settings()
+        logger.info("Reloaded %d active profile(s)", len(self.loop.profiles))
+
+    def apply_metrics_settings(self):
+        """Turn conversion metrics on or off and (re)start their export"""
+        config = self.metrics_export or metrics_config(self.db)
+        metrics = get_metrics() if config else None
+        self.conversion_pool.metrics = metrics
+        self.history_writer.metrics = metrics
+
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
+        if config and any(config):
+            port, textfile = config
+            self.metrics_exporter = MetricsExporter(metrics, port, textfile)
+            self.metrics_exporter.start()
+            if port:
+                logger.info("Serving metrics on http://127.0.0.1:%d/metrics", port)
+
+    def process_file(self, file_path, profile_ids):
+        """Called by the watch loop for each new file, with the profiles that need it"""
+        profiles = []
+        sequence_nums = []
+        for profile_id in profile_ids:
+            profile = self.loop.profiles.get(profile_id)
+            if not profile:
+                self.loop.mark_done(file_path, profile_id, success=False)
+                continue
+
+            logger.info("Processing %s with profile %s", file_path, profile['name'])
+            try:
+                sequence_num = 0
+                if ImageProcessor.uses_sequence(profile['filename_pattern']):
+                    sequence_num = self.db.allocate_sequence(profile_id)
+            except Exception as e:
+                self.loop.mark_done(file_path, profile_id, success=False)
+                logger.error("Error processing %s: %s", file_path, e)
+                continue
+            profiles.append(profile)
+            sequence_nums.append(sequence_num)
+
+        if not profiles:
+            return
+        try:
+            self.conversion_pool.submit_group(profiles, file_path, sequence_nums)
+        except Exception as e:
+            for profile in profiles:
+                self.loop.mark_done(file_path, profile['id'], success=False)
+            logger.error("Error processing %s: %s", file_path, e)
+
+    def on_conversion_finished(self, result):
+        """Called from a conversion worker thread"""
+        if result['destination_path']:
+            self.history_writer.log(result['profile_id'], result['source_path'],
+                                    result['destination_path'], result['content_hash'])
+            if result.get('duplicate_of') == result['destination_path']:
+                logger.info("Skipped duplicate of %s", result['destination_path'])
+            elif result.get('duplicate_of'):
+                logger.info("Linked duplicate to %s", result['destination_path'])
+            elif result.get('cache_hit'):
+                logger.info("Saved to %s (from cache)", result['destination_path'])
+            else:
+                logger.info("Saved to %s", result['destination_path'])
+        else:
+            self.loop.mark_done(result['source_path'], result['profile_id'], success=False)
+            logger.error(result['error'])
+
+    def on_history_flushed(self, records):
+        """Called from the history writer thread once records are committed"""
+        for profile_id, source_path, _, _ in records:
+            self.loop.mark_done(source_path, profile_id)
+
+    def on_history_failed(self, records, error):
+        """Called from the history writer thread when records could not be committed"""
+        for profile_id, source_path, _, _ in records:
+            self.loop.mark_done(source_path, profile_id, success=False)
+        logger.error("Could not record %d processed file(s): %s", len(records), error)
+
+
+class BackfillRunner:
+    """Runs a bulk backfill for each selected profile in turn"""
+
+    def __init__(self, db: Database, profile_names=None, workers=None, recursive=False):
+        self.db = db
+        self.profile_names = set(profile_names) if profile_names else None
+        self.workers = workers or int(db.get_setting('worker_count', 0))
+        self.recursive = recursive
+        self.current = None
+        self.stopped = False
+
+    def selected_profiles(self):
+        profiles = self.db.get_profiles()
+        if self.profile_names:
+            # Named profiles are backfilled even when they are not active
+            return [p for p in profiles if p['name'] in self.profile_names]
+        return [p for p in profiles if p['is_active']]
+
+    def run(self):
+        profiles = self.selected_profiles()
+        if not profiles:
+            logger.warning("No profiles to backfill")
+
+        seen_index = SeenFileIndex()
+        seen_index.build(self.db)
+        for profile in profiles:
+            if self.stopped:
+                break
+            logger.info("Backfilling %s for profile %s", profile['source_folder'], profile['name'])
+            self.current = Backfill(
+                self.db, profile, max_workers=self.workers, recursive=self.recursive,
+                on_progress=lambda progress, name=profile['name']: self.log_progress(name, progress),
+                seen_index=seen_index
+            )
+            self.current.run()
+
+    def stop(self):
+        self.stopped = True
+        if self.current:
+            self.current.stop()
+
+    def log_progress(self, name, progress):
+        eta = "--" if progress['eta'] is None else format_duration(progress['eta'])
+        logger.info(
+            "%s: %d/%d converted, %d failed, %.1f files/s, elapsed %s, ETA %s",
+            name, progress['done'], progress['total'], progress['failed'], progress['rate'],
+            format_duration(progress['elapsed']), eta
+        )
+
+
+def setup_logging(log_file=None):
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=handlers
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run TBICE conversion profiles without the GUI")
+    parser.add_argument("--db", default="image_converter.db",
+                        help="profile database (default: image_converter.db)")
+    parser.add_argument("--profile", action="append", dest="profiles", metavar="NAME",
+                        help="only run this profile; may be repeated (default: all active profiles)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="conversion workers (default: the app setting, or one per CPU core)")
+    parser.add_argument("--log-file", help="also write the log to this file")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="collect conversion metrics and serve them on this localhost port")
+    parser.add_argument("--metrics-file",
+                        help="collect conversion metrics and write them to this file in the "
+                             "Prometheus text format")
+    parser.add_argument("--backfill", action="store_true",
+                        help="convert the images already in the source folders, then exit")
+    parser.add_argument("--recursive", action="store_true",
+                        help="with --backfill, include images in subfolders")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_file)
+
+    db = Database(args.db)
+    if args.backfill:
+        runner = BackfillRunner(db, profile_names=args.profiles, workers=args.workers,
+                                recursive=args.recursive)
+    else:
+        metrics_export = None
+        if args.metrics_port or args.metrics_file:
+            metrics_export = (args.metrics_port, args.metrics_file or '')
+        runner = HeadlessRunner(db, profile_names=args.profiles, workers=args.workers,
+                                metrics_export=metrics_export)
+
+    signal.signal(signal.SIGINT, lambda *_: runner.stop())
+    signal.signal(signal.SIGTERM, lambda *_: runner.stop())
+    if hasattr(signal, 'SIGHUP') and not args.backfill:
+        signal.signal(signal.SIGHUP, lambda *_: runner.request_reload())
+
+    try:
+        runner.run()
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    # Needed for the process conversion engine in frozen builds
+    multiprocessing.freeze_support()
+    sys.exit(main())
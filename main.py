@@ -1,10 +1,14 @@
 import sys
 import os
+import multiprocessing
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QIcon
 from ui.main_window import MainWindow
 
 if __name__ == "__main__":
+    # Needed for the process conversion engine in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
+    
     app = QApplication(sys.argv)
     
     # Set application style
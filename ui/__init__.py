@@ -1,5 +1,6 @@
 from .main_window import MainWindow
 from .profile_editor_dialog import ProfileEditorDialog
 from .profile_list_item import ProfileListItem
+from .settings_dialog import SettingsDialog
 
-__all__ = ['MainWindow', 'ProfileEditorDialog', 'ProfileListItem']
\ No newline at end of file
+__all__ = ['MainWindow', 'ProfileEditorDialog', 'ProfileListItem', 'SettingsDialog']
\ No newline at end of file
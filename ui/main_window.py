@@ -1,6 +1,6 @@
 import os
 from datetime import datetime
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtGui import QColor, QIcon, QPixmap
 
 # Application version
@@ -12,13 +12,29 @@ from PyQt6.QtWidgets import (
 )
 
 from database.db_manager import Database
+from database.history_writer import HistoryWriter
 from utils.folder_watcher import FolderWatcher
+from utils.admission import memory_budget
+from utils.conversion_pool import ConversionPool
 from utils.image_processor import ImageProcessor
+from utils.metrics import MetricsExporter, get_metrics, metrics_config
+from utils.output_cache import output_cache_config
+from utils.profiling import profiling_config, stop_tracing
+from utils.pipeline import invalidate_pipeline
+from utils.tiling import job_memory_limit
 from utils.style_helper import StyleHelper
 from ui.profile_editor_dialog import ProfileEditorDialog
 from ui.profile_list_item import ProfileListItem
+from ui.settings_dialog import SettingsDialog
 
 class MainWindow(QMainWindow):
+    # Emitted from conversion workers; Qt queues it onto the GUI thread
+    conversion_finished = pyqtSignal(dict)
+    # Emitted from the history writer once a batch of records is committed
+    history_flushed = pyqtSignal(list)
+    # Emitted from the history writer when a batch could not be committed
+    history_failed = pyqtSignal(list, str)
+    
     def __init__(self):
         super().__init__()
         
@@ -26,6 +42,29 @@ class MainWindow(QMainWindow):
         self.watcher = FolderWatcher(self.db)
         self.watcher.file_found.connect(self.process_file)
         
+        # Conversions run on a worker pool so the window stays responsive
+        self.conversion_pool = ConversionPool(
+            max_workers=int(self.db.get_setting('worker_count', 0)),
+            on_result=self.record_result,
+            db_path=self.db.db_path,
+            output_cache=output_cache_config(self.db),
+            profiling=profiling_config(self.db),
+            memory_limit=job_memory_limit(self.db),
+            memory_budget=memory_budget(self.db)
+        )
+        self.conversion_finished.connect(self.on_conversion_finished)
+        
+        # Processed files are recorded in batches by a background writer
+        self.history_writer = HistoryWriter(self.db.db_path, on_flush=self.history_flushed.emit,
+                                            on_error=self.history_failed.emit)
+        self.history_flushed.connect(self.on_history_flushed)
+        self.history_failed.connect(self.on_history_failed)
+        self.history_writer.start()
+        
+        # Optional per-stage timings, exported over HTTP or to a text file
+        self.metrics_exporter = None
+        self.apply_metrics_settings()
+        
         self.is_monitoring = False
         
         self.setWindowTitle(f"The Most Basic Image Converter Ever v{APP_VERSION}")
@@ -165,6 +204,11 @@ class MainWindow(QMainWindow):
         
         file_menu.addSeparator()
         
+        settings_action = file_menu.addAction("Settings...")
+        settings_action.triggered.connect(self.show_settings)
+        
+        file_menu.addSeparator()
+        
         exit_action = file_menu.addAction("Exit")
         exit_action.triggered.connect(self.close)
         
@@ -221,6 +265,36 @@ class MainWindow(QMainWindow):
         
         about_dialog.exec()
     
+    def show_settings(self):
+        dialog = SettingsDialog(self.db, parent=self)
+        if dialog.exec():
+            self.conversion_pool.resize(int(self.db.get_setting('worker_count', 0)))
+            self.conversion_pool.output_cache = output_cache_config(self.db)
+            self.conversion_pool.profiling = profiling_config(self.db)
+            self.conversion_pool.memory_limit = job_memory_limit(self.db)
+            self.conversion_pool.set_memory_budget(memory_budget(self.db))
+            if not self.conversion_pool.profiling:
+                stop_tracing()
+            self.apply_metrics_settings()
+            
+            # Restart monitoring so the watcher picks up the new watch mode
+            if self.is_monitoring:
+                self.toggle_monitoring()
+                self.toggle_monitoring()
+    
+    def apply_metrics_settings(self):
+        config = metrics_config(self.db)
+        metrics = get_metrics() if config else None
+        self.conversion_pool.metrics = metrics
+        self.history_writer.metrics = metrics
+        
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
+        if config and any(config):
+            self.metrics_exporter = MetricsExporter(metrics, *config)
+            self.metrics_exporter.start()
+    
     def load_profiles(self):
         self.profiles_list.clear()
         profiles = self.db.get_profiles()
@@ -277,17 +351,6 @@ class MainWindow(QMainWindow):
             # Reload watcher profiles
             self.watcher.reload_profiles()
             
-            # If monitoring is active, reload processed files to keep in-memory cache in sync
-            if self.is_monitoring:
-                # Get processed files from database in the main thread
-                processed_files = []
-                for profile_id in self.watcher.profiles.keys():
-                    files = self.db.get_processed_files(profile_id)
-                    processed_files.extend(files)
-                
-                # Update the watcher's cache with data from main thread
-                self.watcher.load_processed_files_from_main(processed_files)
-            
             # Stop and restart monitoring if it was running to apply changes
             was_monitoring = self.is_monitoring
             if was_monitoring:
@@ -310,19 +373,9 @@ class MainWindow(QMainWindow):
         # Reload profile list
         self.load_profiles()
         
-        # Reload profiles in watcher and update processed files cache
+        # Reload profiles in watcher; a newly activated profile needs its folder scanned
         self.watcher.reload_profiles()
-        
-        # If monitoring is active, reload processed files to keep in-memory cache in sync
-        if self.is_monitoring:
-            # Get processed files from database in the main thread
-            processed_files = []
-            for profile_id in self.watcher.profiles.keys():
-                files = self.db.get_processed_files(profile_id)
-                processed_files.extend(files)
-            
-            # Update the watcher's cache with data from main thread
-            self.watcher.load_processed_files_from_main(processed_files)
+        self.watcher.request_rescan()
     
     def delete_profile(self):
         selected_items = self.profiles_list.selectedItems()
@@ -342,6 +395,7 @@ class MainWindow(QMainWindow):
         
         if reply == QMessageBox.StandardButton.Yes:
             self.db.delete_profile(profile_id)
+            invalidate_pipeline(profile_id)
             self.load_profiles()
             
             # Disable buttons
@@ -354,19 +408,8 @@ class MainWindow(QMainWindow):
             self.toggle_active_action.setEnabled(False)
             self.delete_profile_action.setEnabled(False)
             
-            # Reload profiles in watcher and update processed files cache
+            # Reload profiles in watcher
             self.watcher.reload_profiles()
-            
-            # If monitoring is active, reload processed files to keep in-memory cache in sync
-            if self.is_monitoring:
-                # Get processed files from database in the main thread
-                processed_files = []
-                for profile_id in self.watcher.profiles.keys():
-                    files = self.db.get_processed_files(profile_id)
-                    processed_files.extend(files)
-                
-                # Update the watcher's cache with data from main thread
-                self.watcher.load_processed_files_from_main(processed_files)
     
     def toggle_monitoring(self):
         if self.is_monitoring:
@@ -393,50 +436,90 @@ class MainWindow(QMainWindow):
             
             self.is_monitoring = True
     
-    def process_file(self, file_path, profile_id):
-        try:
-            profile = self.db.get_profile(profile_id)
-            if not profile:
-                return
-                
-            # Log the file detection
-            self.log_message(f"Processing {file_path} with profile {profile['name']}")
-            
-            # Process the image
-            processor = ImageProcessor(profile)
-            img = processor.process_image(file_path)
-            
-            if img:
-                # Make sure directory exists
-                os.makedirs(profile['destination_folder'], exist_ok=True)
-                
-                # Get count of existing files for this profile
-                try:
-                    count = len(os.listdir(profile['destination_folder']))
-                except:
-                    count = 0
-                
-                # Save the processed image
-                dest_path = processor.save_image(img, file_path, sequence_num=count+1)
-                
-                if dest_path:
-                    # Log the processed file in database
-                    self.db.log_processed_file(profile_id, file_path, dest_path)
-                    
-                    # Update UI log
-                    self.log_message(f"Saved to {dest_path}")
+    def process_file(self, file_path, profile_ids):
+        profiles = []
+        sequence_nums = []
+        for profile_id in profile_ids:
+            try:
+                profile = self.db.get_profile(profile_id)
+                if not profile:
+                    self.watcher.mark_done(file_path, profile_id, success=False)
+                    continue
                     
-                    # Update the file count display if available
-                    if profile_id in self.profile_widgets:
-                        self.profile_widgets[profile_id].update_files_count()
-                else:
-                    self.log_message(f"Failed to save processed image", error=True)
-            else:
-                self.log_message(f"Failed to process {file_path}", error=True)
+                # Log the file detection
+                self.log_message(f"Processing {file_path} with profile {profile['name']}")
                 
+                # Take the next {seq} number from the profile's counter; only
+                # patterns that use it need to touch the database
+                sequence_num = 0
+                if ImageProcessor.uses_sequence(profile['filename_pattern']):
+                    sequence_num = self.db.allocate_sequence(profile_id)
+                
+                profiles.append(profile)
+                sequence_nums.append(sequence_num)
+            except Exception as e:
+                self.watcher.mark_done(file_path, profile_id, success=False)
+                self.log_message(f"Error processing {file_path}: {e}", error=True)
+        
+        if not profiles:
+            return
+        
+        try:
+            # Hand the conversions to the worker pool, which decodes the file
+            # once for all of them; results come back through on_conversion_finished
+            self.conversion_pool.submit_group(profiles, file_path, sequence_nums)
         except Exception as e:
+            for profile in profiles:
+                self.watcher.mark_done(file_path, profile['id'], success=False)
             self.log_message(f"Error processing {file_path}: {e}", error=True)
     
+    def record_result(self, result):
+        """Called from a conversion worker thread"""
+        if result['destination_path']:
+            # Queued for the database straight away, so conversions finishing
+            # while the window closes are still recorded; the watcher is told
+            # once the record is committed (see on_history_flushed)
+            self.history_writer.log(result['profile_id'], result['source_path'],
+                                    result['destination_path'], result['content_hash'])
+        self.conversion_finished.emit(result)
+    
+    def on_conversion_finished(self, result):
+        """Handle a finished conversion job on the GUI thread"""
+        profile_id = result['profile_id']
+        dest_path = result['destination_path']
+        
+        if dest_path:
+            # Update UI log
+            if result.get('duplicate_of') == dest_path:
+                self.log_message(f"Skipped duplicate of {dest_path}")
+            elif result.get('duplicate_of'):
+                self.log_message(f"Linked duplicate to {dest_path}")
+            elif result.get('cache_hit'):
+                self.log_message(f"Saved to {dest_path} (from cache)")
+            else:
+                self.log_message(f"Saved to {dest_path}")
+        else:
+            self.watcher.mark_done(result['source_path'], profile_id, success=False)
+            self.log_message(result['error'], error=True)
+    
+    def on_history_flushed(self, records):
+        """Handle a batch of processed files committed by the history writer"""
+        profile_ids = set()
+        for profile_id, source_path, _, _ in records:
+            self.watcher.mark_done(source_path, profile_id)
+            profile_ids.add(profile_id)
+        
+        # Update the file count displays if available
+        for profile_id in profile_ids:
+            if profile_id in self.profile_widgets:
+                self.profile_widgets[profile_id].update_files_count()
+    
+    def on_history_failed(self, records, error):
+        """Handle a batch of processed files the history writer could not commit"""
+        for profile_id, source_path, _, _ in records:
+            self.watcher.mark_done(source_path, profile_id, success=False)
+        self.log_message(f"Could not record {len(records)} processed file(s): {error}", error=True)
+    
     def log_message(self, message, error=False):
         # Create item with timestamp
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -456,16 +539,10 @@ class MainWindow(QMainWindow):
         # Update the profile list items to show correct file counts
         self.update_profile_file_counts()
         
-        # If monitoring is active, reload the watcher's processed files cache from main thread
+        # Files whose history was cleared are picked up again on the next scan;
+        # the watcher checks the database, so there is no cache to reload
         if self.is_monitoring:
-            # Get processed files from database in the main thread
-            processed_files = []
-            for profile_id in self.watcher.profiles.keys():
-                files = self.db.get_processed_files(profile_id)
-                processed_files.extend(files)
-            
-            # Update the watcher's cache with data from main thread
-            self.watcher.load_processed_files_from_main(processed_files)
+            self.watcher.request_rescan()
             
     def update_profile_file_counts(self):
         """Update all profile list items' file count displays"""
@@ -544,6 +621,15 @@ class MainWindow(QMainWindow):
             self.watcher.stop()
             self.watcher.wait()
         
+        # Drop queued conversions and wait for the running ones to finish
+        self.conversion_pool.shutdown(wait=True, cancel_pending=True)
+        
+        # Write any processed files still waiting in the history writer
+        self.history_writer.stop()
+        
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        
         # Close database connection
         self.db.close()
         
@@ -0,0 +1,198 @@
+import threading
+from collections import OrderedDict
+from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtGui import QImage
+from PIL import Image
+from utils.image_processor import ImageProcessor
+from utils.pipeline import BoxResizeOp, preview_geometry
+
+# Largest size the preview labels display
+PREVIEW_SIZE = (350, 250)
+
+# Number of rendered pipeline stages kept for reuse
+STAGE_CACHE_SIZE = 8
+
+def pil_to_qimage(pil_image: Image.Image, max_size=PREVIEW_SIZE) -> QImage:
+    """Scale a PIL image down to fit max_size and wrap it in a QImage.
+    
+    The image is scaled before anything else, so only display-sized
+    buffers are ever created, and RGB and RGBA pixels are exported in the
+    4-bytes-per-pixel layout PIL stores them in, which QImage reads
+    directly: one allocation when no scaling is needed. The QImage borrows
+    that buffer rather than copying it, so the buffer is kept on the
+    returned object; pass it through signals as object (not QImage) so the
+    reference survives until it is turned into a pixmap.
+    """
+    img = pil_image
+    width, height = img.size
+    scale = min(1.0, max_size[0] / width, max_size[1] / height)
+    if scale < 1.0:
+        # Same filter as Image.thumbnail
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img = img.resize(size, Image.BICUBIC, reducing_gap=2.0)
+    
+    if img.mode == "RGB":
+        raw_mode, image_format = "RGBX", QImage.Format.Format_RGBX8888
+    else:
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        raw_mode, image_format = "RGBA", QImage.Format.Format_RGBA8888
+    
+    buffer = img.tobytes("raw", raw_mode)
+    qimage = QImage(buffer, img.width, img.height, 4 * img.width, image_format)
+    qimage.pil_buffer = buffer  # QImage does not own the bytes
+    return qimage
+
+class PreviewWorker(QThread):
+    """Renders profile editor previews off the GUI thread.
+
+    Only the most recent request matters: each new request or source
+    replaces any request still waiting, and a render that is overtaken by a
+    newer request is abandoned between pipeline operations and never
+    reported. Results are delivered as display-sized QImages.
+
+    Previews are rendered at display size: the profile's resizes and crops
+    are reduced to one region of the sample, which is scaled straight to
+    the preview size from a cached reduced copy of the sample (the smallest
+    power-of-two reduction with enough pixels). The output of every stage
+    is cached, so changing only an enhancement reuses the resized region.
+    """
+    # Emitted as object so the QImage keeps its pixel buffer (see pil_to_qimage)
+    source_ready = pyqtSignal(object)  # QImage thumbnail of the loaded sample image
+    preview_ready = pyqtSignal(object)  # QImage thumbnail of the processed sample image
+    preview_failed = pyqtSignal(str)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.condition = threading.Condition()
+        self.generation = 0  # Bumped by every request; older renders are stale
+        self.source_path = None
+        self.source_changed = False
+        self.pending_profile = None
+        self.running = True
+        # Only touched by the worker thread
+        self.source = None
+        self.proxies = {}  # reduction factor -> reduced copy of the source
+        self.stage_cache = OrderedDict()  # (factor, ops so far) -> image
+    
+    def set_source(self, file_path):
+        """Load a new sample image; the source thumbnail arrives through source_ready"""
+        with self.condition:
+            self.source_path = file_path
+            self.source_changed = True
+            self.generation += 1
+            self.condition.notify()
+    
+    def request(self, profile):
+        """Render the sample image with these profile settings, replacing any waiting request"""
+        with self.condition:
+            self.pending_profile = profile
+            self.generation += 1
+            self.condition.notify()
+    
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.generation += 1
+            self.condition.notify()
+        self.wait()
+    
+    def is_stale(self, generation):
+        return generation != self.generation
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.source_changed and self.pending_profile is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                
+                generation = self.generation
+                source_path = self.source_path if self.source_changed else None
+                self.source_changed = False
+                profile = self.pending_profile
+                self.pending_profile = None
+            
+            try:
+                if source_path:
+                    self.load_source(source_path)
+                if profile and self.source is not None:
+                    self.render(profile, generation)
+            except Exception as e:
+                if not self.is_stale(generation):
+                    self.preview_failed.emit(str(e))
+    
+    def load_source(self, source_path):
+        img = Image.open(source_path)
+        img.load()
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        self.source = img
+        self.proxies = {1: img}
+        self.stage_cache.clear()
+        self.source_ready.emit(pil_to_qimage(img))
+    
+    def get_proxy(self, factor):
+        proxy = self.proxies.get(factor)
+        if proxy is None:
+            proxy = self.proxies[factor] = self.source.reduce(factor)
+        return proxy
+    
+    def render(self, profile, generation):
+        pipeline = ImageProcessor(profile).pipeline
+        geometry = preview_geometry(pipeline, self.source.size, PREVIEW_SIZE)
+        if geometry is None:
+            self.render_full(pipeline, generation)
+            return
+        
+        box, display_size, tail_ops = geometry
+        
+        # Largest power-of-two reduction that still has a pixel per display pixel
+        factor = 1
+        while (factor * 2 * display_size[0] <= box[2] - box[0]
+               and factor * 2 * display_size[1] <= box[3] - box[1]):
+            factor *= 2
+        proxy = self.get_proxy(factor)
+        
+        scale_x = proxy.width / self.source.width
+        scale_y = proxy.height / self.source.height
+        proxy_box = (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)
+        ops = [BoxResizeOp(display_size, proxy_box)] + tail_ops
+        
+        img = proxy
+        key = (factor, pipeline.reducing_gap)
+        for op in ops:
+            key += (op,)
+            cached = self.stage_cache.get(key)
+            if cached is None:
+                if self.is_stale(generation):
+                    return
+                cached = pipeline.apply(op, img, img.size)
+                self.stage_cache[key] = cached
+                if len(self.stage_cache) > STAGE_CACHE_SIZE:
+                    self.stage_cache.popitem(last=False)
+            else:
+                self.stage_cache.move_to_end(key)
+            img = cached
+        
+        qimage = pil_to_qimage(img)
+        if not self.is_stale(generation):
+            self.preview_ready.emit(qimage)
+    
+    def render_full(self, pipeline, generation):
+        """Render at full resolution, for geometry the proxy path cannot express"""
+        img = self.source
+        
+        # Same steps as ImageProcessor.process_image, checking for a newer
+        # request between operations
+        source_size = img.size
+        for op in pipeline.ops:
+            if self.is_stale(generation):
+                return
+            img = pipeline.apply(op, img, source_size)
+            source_size = img.size
+        
+        qimage = pil_to_qimage(img)
+        if not self.is_stale(generation):
+            self.preview_ready.emit(qimage)
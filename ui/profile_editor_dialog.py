@@ -1,6 +1,6 @@
 import os
-from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtGui import QImage, QPixmap, QIcon
+from PyQt6.QtCore import Qt, pyqtSignal, QTimer
+from PyQt6.QtGui import QPixmap, QIcon
 from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QGroupBox, QLabel, QLineEdit, 
     QPushButton, QComboBox, QSlider, QCheckBox, QSpinBox, QFileDialog, 
@@ -8,7 +8,15 @@ from PyQt6.QtWidgets import (
 )
 from PIL import Image
 from database.db_manager import Database
-from utils.image_processor import ImageProcessor
+from utils.image_processor import DECODE_MODES, DECODE_QUALITY
+from utils.pipeline import invalidate_pipeline
+from utils.conversion_pool import CONVERSION_ENGINES
+from utils.dedupe import DUPLICATE_MODES, DUPLICATE_OFF
+from utils.admission import DEFAULT_PRIORITY, MAX_PRIORITY
+from ui.preview_worker import PreviewWorker
+
+# Settings changes are coalesced for this long before a preview is rendered
+PREVIEW_DEBOUNCE_MS = 80
 
 class ProfileEditorDialog(QDialog):
     # Signal emitted when profile is created, updated, or processed files are cleared
@@ -20,9 +28,20 @@ class ProfileEditorDialog(QDialog):
         self.profile_id = profile_id
         self.profile = None
         self.preview_source_image = None
-        self.preview_processed_image = None
         self.original_aspect_ratio = 1.0  # For maintaining aspect ratio
         
+        # Previews render on a worker thread, once settings stop changing
+        self.preview_worker = PreviewWorker(self)
+        self.preview_worker.source_ready.connect(self.on_preview_source_ready)
+        self.preview_worker.preview_ready.connect(self.on_preview_ready)
+        self.preview_worker.preview_failed.connect(self.on_preview_failed)
+        self.preview_worker.start()
+        
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.preview_timer.timeout.connect(self.render_preview)
+        
         if profile_id:
             self.profile = self.db.get_profile(profile_id)
         
@@ -88,6 +107,44 @@ class ProfileEditorDialog(QDialog):
         format_layout.addWidget(self.format_combo)
         left_layout.addLayout(format_layout)
         
+        # Conversion engine
+        engine_layout = QHBoxLayout()
+        engine_layout.addWidget(QLabel("Conversion Engine:"))
+        self.engine_combo = QComboBox()
+        self.engine_combo.addItems(CONVERSION_ENGINES)
+        self.engine_combo.setToolTip(
+            "Process runs conversions in separate processes, which scales better "
+            "across CPU cores for profiles with heavy resizing and enhancements"
+        )
+        engine_layout.addWidget(self.engine_combo)
+        left_layout.addLayout(engine_layout)
+        
+        # Duplicate handling
+        duplicate_layout = QHBoxLayout()
+        duplicate_layout.addWidget(QLabel("Duplicate Files:"))
+        self.duplicate_combo = QComboBox()
+        self.duplicate_combo.addItems(DUPLICATE_MODES)
+        self.duplicate_combo.setToolTip(
+            "Files with exactly the same content as one already converted can be "
+            "skipped, or get a hard link to the existing output instead of being re-encoded"
+        )
+        duplicate_layout.addWidget(self.duplicate_combo)
+        left_layout.addLayout(duplicate_layout)
+        
+        # Share of the workers while other profiles also have files waiting
+        priority_layout = QHBoxLayout()
+        priority_layout.addWidget(QLabel("Priority:"))
+        self.priority_spin = QSpinBox()
+        self.priority_spin.setRange(1, MAX_PRIORITY)
+        self.priority_spin.setValue(DEFAULT_PRIORITY)
+        self.priority_spin.setToolTip(
+            "When several profiles have files waiting, each gets conversions in proportion "
+            "to its priority: a priority 3 profile converts three files for every one of a "
+            "priority 1 profile, so a bulk load cannot hold up the others"
+        )
+        priority_layout.addWidget(self.priority_spin)
+        left_layout.addLayout(priority_layout)
+        
         # Filename pattern
         pattern_layout = QHBoxLayout()
         pattern_layout.addWidget(QLabel("Filename Pattern:"))
@@ -181,6 +238,20 @@ class ProfileEditorDialog(QDialog):
         self.resize_method_container.addLayout(self.dimensions_layout)
         
         resize_group_layout.addLayout(self.resize_method_container)
+        
+        # Reduced-size JPEG decoding when scaling down
+        decode_layout = QHBoxLayout()
+        decode_layout.addWidget(QLabel("JPEG Decoding:"))
+        self.decode_combo = QComboBox()
+        self.decode_combo.addItems(DECODE_MODES)
+        self.decode_combo.setToolTip(
+            "When shrinking JPEGs, decode them directly at a smaller size.\n"
+            "Quality: same visual result as Full, much faster for large reductions.\n"
+            "Fast: fastest, may be slightly softer.\n"
+            "Full: always decode every pixel."
+        )
+        decode_layout.addWidget(self.decode_combo)
+        resize_group_layout.addLayout(decode_layout)
         resize_group.setLayout(resize_group_layout)
         right_layout.addWidget(resize_group)
         
@@ -368,12 +439,10 @@ class ProfileEditorDialog(QDialog):
         )
         if file_path:
             try:
+                # Only the header is read here; the worker decodes the image
                 self.preview_source_image = Image.open(file_path)
+                self.preview_worker.set_source(file_path)
                 self.update_preview()
-                
-                # Display source image
-                pixmap = self.get_pixmap_from_pil_image(self.preview_source_image)
-                self.source_preview.setPixmap(pixmap)
             except Exception as e:
                 QMessageBox.warning(self, "Error", f"Failed to load image: {e}")
     
@@ -384,22 +453,31 @@ class ProfileEditorDialog(QDialog):
         if not self.preview_source_image:
             return
         
-        try:
-            # Create a temporary profile with current settings
-            temp_profile = self.get_current_profile_data()
-            
-            # Create a processor with this profile
-            processor = ImageProcessor(temp_profile)
-            
-            # Process the image - pass the source image object directly
-            self.preview_processed_image = processor.process_image(self.preview_source_image)
-            
-            if self.preview_processed_image:
-                # Display processed image
-                pixmap = self.get_pixmap_from_pil_image(self.preview_processed_image)
-                self.processed_preview.setPixmap(pixmap)
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"Failed to update preview: {e}")
+        # Restart the debounce timer; only the settings in place when it
+        # fires are rendered
+        self.preview_timer.start()
+    
+    def render_preview(self):
+        if not self.preview_source_image:
+            return
+        
+        # Create a temporary profile with current settings
+        self.preview_worker.request(self.get_current_profile_data())
+    
+    def on_preview_source_ready(self, qimage):
+        self.source_preview.setPixmap(QPixmap.fromImage(qimage))
+    
+    def on_preview_ready(self, qimage):
+        self.processed_preview.setPixmap(QPixmap.fromImage(qimage))
+    
+    def on_preview_failed(self, error):
+        QMessageBox.warning(self, "Error", f"Failed to update preview: {error}")
+    
+    def done(self, result):
+        # Stop rendering before the dialog goes away
+        self.preview_timer.stop()
+        self.preview_worker.stop()
+        super().done(result)
     
     def update_processed_files_count(self):
         if hasattr(self, 'processed_files_label') and self.profile_id:
@@ -439,34 +517,6 @@ class ProfileEditorDialog(QDialog):
                     "These files will be processed again the next time monitoring starts."
                 )
     
-    def get_pixmap_from_pil_image(self, pil_image):
-        # Convert PIL image to QPixmap for display
-        if not pil_image:
-            return QPixmap()
-            
-        # Make a copy to avoid modifying the original
-        img = pil_image.copy()
-        
-        # Ensure we're in the correct mode for display
-        if img.mode == "RGBA":
-            img_mode = img
-        else:
-            img_mode = img.convert("RGBA")
-        
-        # Resize to fit in preview area while maintaining aspect ratio
-        img_mode.thumbnail((350, 250))
-        
-        # Get the correct data from the image
-        width, height = img_mode.size
-        bytes_per_line = 4 * width
-        buffer = img_mode.tobytes("raw", "RGBA")
-        
-        # Create QImage with the correct format and byte order
-        qim = QImage(buffer, width, height, bytes_per_line, QImage.Format.Format_RGBA8888)
-            
-        pixmap = QPixmap.fromImage(qim)
-        return pixmap
-    
     def clear_layout(self, layout):
         """Recursively remove all items from a layout"""
         if layout is None:
@@ -571,6 +621,7 @@ class ProfileEditorDialog(QDialog):
         )
         if file_path:
             try:
+                # Only the header is read here; the worker decodes the image
                 self.preview_source_image = Image.open(file_path)
                 
                 # Store aspect ratio for maintain aspect ratio feature
@@ -578,11 +629,8 @@ class ProfileEditorDialog(QDialog):
                 if height > 0:
                     self.original_aspect_ratio = width / height
                 
+                self.preview_worker.set_source(file_path)
                 self.update_preview()
-                
-                # Display source image
-                pixmap = self.get_pixmap_from_pil_image(self.preview_source_image)
-                self.source_preview.setPixmap(pixmap)
             except Exception as e:
                 QMessageBox.warning(self, "Error", f"Failed to load image: {e}")
     
@@ -607,12 +655,16 @@ class ProfileEditorDialog(QDialog):
             'source_folder': self.source_input.text(),
             'destination_folder': self.dest_input.text(),
             'output_format': self.format_combo.currentText(),
+            'conversion_engine': self.engine_combo.currentText(),
+            'duplicate_mode': self.duplicate_combo.currentText(),
+            'priority': self.priority_spin.value(),
             'filename_pattern': self.pattern_input.text(),
             'is_active': 1 if self.active_checkbox.isChecked() else 0,
             'resize_width': resize_width,
             'resize_height': resize_height,
             'resize_method': resize_method,  # Store the method for later use
             'keep_aspect_ratio': self.keep_aspect_ratio.isChecked(),
+            'decode_mode': self.decode_combo.currentText(),
             'crop_left': self.crop_left.value(),
             'crop_top': self.crop_top.value(),
             'crop_right': self.crop_right.value(),
@@ -648,6 +700,9 @@ class ProfileEditorDialog(QDialog):
                 'source_folder': current_data['source_folder'],
                 'destination_folder': current_data['destination_folder'],
                 'output_format': current_data['output_format'],
+                'conversion_engine': current_data['conversion_engine'],
+                'duplicate_mode': current_data['duplicate_mode'],
+                'priority': current_data['priority'],
                 'filename_pattern': current_data['filename_pattern'],
                 'is_active': current_data['is_active']
             }
@@ -658,6 +713,7 @@ class ProfileEditorDialog(QDialog):
                 'resize_height': current_data['resize_height'],
                 'resize_method': current_data['resize_method'],
                 'keep_aspect_ratio': 1 if current_data['keep_aspect_ratio'] else 0,
+                'decode_mode': current_data['decode_mode'],
                 'crop_left': current_data['crop_left'],
                 'crop_top': current_data['crop_top'],
                 'crop_right': current_data['crop_right'],
@@ -670,7 +726,10 @@ class ProfileEditorDialog(QDialog):
             }
             
             # Save to database
-            self.db.save_profile(profile_data, settings_data)
+            profile_id = self.db.save_profile(profile_data, settings_data)
+            
+            # Recompile the profile's processing pipeline on next use
+            invalidate_pipeline(profile_id)
             
             # Emit signal that profile was updated
             self.profile_updated.emit()
@@ -694,6 +753,18 @@ class ProfileEditorDialog(QDialog):
         if format_index >= 0:
             self.format_combo.setCurrentIndex(format_index)
         
+        # Set conversion engine
+        engine_index = self.engine_combo.findText(self.profile.get('conversion_engine') or 'Thread')
+        if engine_index >= 0:
+            self.engine_combo.setCurrentIndex(engine_index)
+        
+        # Set duplicate handling
+        duplicate_index = self.duplicate_combo.findText(self.profile.get('duplicate_mode') or DUPLICATE_OFF)
+        if duplicate_index >= 0:
+            self.duplicate_combo.setCurrentIndex(duplicate_index)
+        
+        self.priority_spin.setValue(self.profile.get('priority') or DEFAULT_PRIORITY)
+        
         # Set active status
         self.active_checkbox.setChecked(bool(self.profile['is_active']))
         
@@ -725,6 +796,10 @@ class ProfileEditorDialog(QDialog):
         elif self.stored_resize_method == "Percentage" and self.stored_resize_width == -1:
             self.resize_percentage.setValue(self.stored_resize_height)
         
+        decode_index = self.decode_combo.findText(self.profile.get('decode_mode') or DECODE_QUALITY)
+        if decode_index >= 0:
+            self.decode_combo.setCurrentIndex(decode_index)
+        
         # Set crop values
         self.crop_left.setValue(self.profile['crop_left'])
         self.crop_top.setValue(self.profile['crop_top'])
@@ -0,0 +1,284 @@
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QGroupBox, QLabel, QPushButton, QSpinBox,
+    QComboBox, QCheckBox, QLineEdit
+)
+from database.db_manager import Database
+from utils.admission import DEFAULT_MEMORY_BUDGET_MB
+from utils.conversion_pool import default_worker_count
+from utils.output_cache import DEFAULT_CACHE_SIZE_MB
+from utils.profiling import DEFAULT_MIN_SECONDS, DEFAULT_MIN_MEMORY_MB
+from utils.tiling import DEFAULT_JOB_MEMORY_MB
+from utils.folder_watcher import WATCH_MODES, WATCH_MODE_AUTO, DEFAULT_STABILITY_CHECKS
+
+class SettingsDialog(QDialog):
+    def __init__(self, db: Database, parent=None):
+        super().__init__(parent)
+        self.db = db
+
+        self.setWindowTitle("Settings")
+        self.setMinimumWidth(420)
+
+        self.setup_ui()
+        self.load_settings()
+
+    def setup_ui(self):
+        main_layout = QVBoxLayout()
+
+        # Conversion settings
+        conversion_group = QGroupBox("Conversion")
+        conversion_layout = QVBoxLayout()
+
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Workers:"))
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setMinimum(0)
+        self.workers_spin.setMaximum(256)
+        self.workers_spin.setSpecialValueText(f"Auto ({default_worker_count()})")
+        workers_layout.addWidget(self.workers_spin)
+        conversion_layout.addLayout(workers_layout)
+
+        help_label = QLabel("Number of images converted in parallel, per conversion engine. "
+                            "Auto uses one worker per CPU core.")
+        help_label.setStyleSheet("color: gray; font-size: 12px;")
+        help_label.setWordWrap(True)
+        conversion_layout.addWidget(help_label)
+
+        memory_layout = QHBoxLayout()
+        memory_layout.addWidget(QLabel("Memory per Job:"))
+        self.job_memory_spin = QSpinBox()
+        self.job_memory_spin.setMinimum(0)
+        self.job_memory_spin.setMaximum(1024 * 1024)
+        self.job_memory_spin.setSingleStep(256)
+        self.job_memory_spin.setSuffix(" MB")
+        self.job_memory_spin.setSpecialValueText("Unlimited")
+        memory_layout.addWidget(self.job_memory_spin)
+        conversion_layout.addLayout(memory_layout)
+
+        budget_layout = QHBoxLayout()
+        budget_layout.addWidget(QLabel("Memory Budget:"))
+        self.memory_budget_spin = QSpinBox()
+        self.memory_budget_spin.setMinimum(0)
+        self.memory_budget_spin.setMaximum(1024 * 1024)
+        self.memory_budget_spin.setSingleStep(512)
+        self.memory_budget_spin.setSuffix(" MB")
+        self.memory_budget_spin.setSpecialValueText("Unlimited")
+        budget_layout.addWidget(self.memory_budget_spin)
+        conversion_layout.addLayout(budget_layout)
+
+        memory_help_label = QLabel("Images that would take more memory than the per-job limit to "
+                                   "decode are processed in bands of rows instead of all at once. "
+                                   "Conversions only start while their estimated memory, added "
+                                   "together, fits in the budget; smaller images go ahead of large "
+                                   "ones waiting for memory.")
+        memory_help_label.setStyleSheet("color: gray; font-size: 12px;")
+        memory_help_label.setWordWrap(True)
+        conversion_layout.addWidget(memory_help_label)
+
+        conversion_group.setLayout(conversion_layout)
+        main_layout.addWidget(conversion_group)
+
+        # Monitoring settings
+        monitoring_group = QGroupBox("Monitoring")
+        monitoring_layout = QVBoxLayout()
+
+        watch_mode_layout = QHBoxLayout()
+        watch_mode_layout.addWidget(QLabel("Watch Mode:"))
+        self.watch_mode_combo = QComboBox()
+        self.watch_mode_combo.addItems(WATCH_MODES)
+        watch_mode_layout.addWidget(self.watch_mode_combo)
+        monitoring_layout.addLayout(watch_mode_layout)
+
+        watch_help_label = QLabel("Auto uses file system events on Linux and checks folders "
+                                  "once per second elsewhere. Use Polling for network shares "
+                                  "that do not report changes.")
+        watch_help_label.setStyleSheet("color: gray; font-size: 12px;")
+        watch_help_label.setWordWrap(True)
+        monitoring_layout.addWidget(watch_help_label)
+
+        stability_layout = QHBoxLayout()
+        stability_layout.addWidget(QLabel("Stability Checks:"))
+        self.stability_spin = QSpinBox()
+        self.stability_spin.setMinimum(1)
+        self.stability_spin.setMaximum(60)
+        self.stability_spin.setSuffix(" s")
+        stability_layout.addWidget(self.stability_spin)
+        monitoring_layout.addLayout(stability_layout)
+
+        stability_help_label = QLabel("Files found by scanning are converted only after their size "
+                                      "has stopped changing for this long, so partially copied "
+                                      "files are never processed.")
+        stability_help_label.setStyleSheet("color: gray; font-size: 12px;")
+        stability_help_label.setWordWrap(True)
+        monitoring_layout.addWidget(stability_help_label)
+
+        monitoring_group.setLayout(monitoring_layout)
+        main_layout.addWidget(monitoring_group)
+
+        # Output cache settings
+        cache_group = QGroupBox("Output Cache")
+        cache_layout = QVBoxLayout()
+
+        self.cache_checkbox = QCheckBox("Reuse previous outputs for identical images and settings")
+        self.cache_checkbox.toggled.connect(lambda checked: self.cache_size_spin.setEnabled(checked))
+        cache_layout.addWidget(self.cache_checkbox)
+
+        cache_size_layout = QHBoxLayout()
+        cache_size_layout.addWidget(QLabel("Cache Size:"))
+        self.cache_size_spin = QSpinBox()
+        self.cache_size_spin.setMinimum(16)
+        self.cache_size_spin.setMaximum(1024 * 1024)
+        self.cache_size_spin.setSingleStep(256)
+        self.cache_size_spin.setSuffix(" MB")
+        cache_size_layout.addWidget(self.cache_size_spin)
+        cache_layout.addLayout(cache_size_layout)
+
+        cache_help_label = QLabel("Reprocessing a file, or converting it with another profile that "
+                                  "has the same image settings and format, copies the cached output "
+                                  "instead of converting again. The least recently used outputs are "
+                                  "removed once the cache is full.")
+        cache_help_label.setStyleSheet("color: gray; font-size: 12px;")
+        cache_help_label.setWordWrap(True)
+        cache_layout.addWidget(cache_help_label)
+
+        cache_group.setLayout(cache_layout)
+        main_layout.addWidget(cache_group)
+
+        # Metrics settings
+        metrics_group = QGroupBox("Metrics")
+        metrics_layout = QVBoxLayout()
+
+        self.metrics_checkbox = QCheckBox("Collect conversion timings")
+        self.metrics_checkbox.toggled.connect(self.update_metrics_fields)
+        metrics_layout.addWidget(self.metrics_checkbox)
+
+        metrics_port_layout = QHBoxLayout()
+        metrics_port_layout.addWidget(QLabel("HTTP Port:"))
+        self.metrics_port_spin = QSpinBox()
+        self.metrics_port_spin.setMinimum(0)
+        self.metrics_port_spin.setMaximum(65535)
+        self.metrics_port_spin.setSpecialValueText("Off")
+        metrics_port_layout.addWidget(self.metrics_port_spin)
+        metrics_layout.addLayout(metrics_port_layout)
+
+        metrics_file_layout = QHBoxLayout()
+        metrics_file_layout.addWidget(QLabel("Text File:"))
+        self.metrics_file_edit = QLineEdit()
+        self.metrics_file_edit.setPlaceholderText("Not written")
+        metrics_file_layout.addWidget(self.metrics_file_edit)
+        metrics_layout.addLayout(metrics_file_layout)
+
+        metrics_help_label = QLabel("Times decoding, resizing, enhancing, encoding and history writes "
+                                    "per profile. The port serves /metrics (Prometheus) and /stats "
+                                    "(JSON) on this computer only; the text file is rewritten every "
+                                    "15 seconds.")
+        metrics_help_label.setStyleSheet("color: gray; font-size: 12px;")
+        metrics_help_label.setWordWrap(True)
+        metrics_layout.addWidget(metrics_help_label)
+
+        metrics_group.setLayout(metrics_layout)
+        main_layout.addWidget(metrics_group)
+
+        # Profiling settings
+        profiling_group = QGroupBox("Profiling")
+        profiling_layout = QVBoxLayout()
+
+        self.profiling_checkbox = QCheckBox("Capture profiles of slow conversions")
+        self.profiling_checkbox.toggled.connect(self.update_profiling_fields)
+        profiling_layout.addWidget(self.profiling_checkbox)
+
+        profiling_seconds_layout = QHBoxLayout()
+        profiling_seconds_layout.addWidget(QLabel("Slower Than:"))
+        self.profiling_seconds_spin = QSpinBox()
+        self.profiling_seconds_spin.setMinimum(1)
+        self.profiling_seconds_spin.setMaximum(3600)
+        self.profiling_seconds_spin.setSuffix(" s")
+        profiling_seconds_layout.addWidget(self.profiling_seconds_spin)
+        profiling_layout.addLayout(profiling_seconds_layout)
+
+        profiling_memory_layout = QHBoxLayout()
+        profiling_memory_layout.addWidget(QLabel("Or Using More Than:"))
+        self.profiling_memory_spin = QSpinBox()
+        self.profiling_memory_spin.setMinimum(16)
+        self.profiling_memory_spin.setMaximum(1024 * 1024)
+        self.profiling_memory_spin.setSingleStep(128)
+        self.profiling_memory_spin.setSuffix(" MB")
+        profiling_memory_layout.addWidget(self.profiling_memory_spin)
+        profiling_layout.addLayout(profiling_memory_layout)
+
+        profiling_help_label = QLabel("Runs each conversion under the Python profiler and keeps the "
+                                      "result, with the source path and profile, in a 'profiling' "
+                                      "folder next to the database when it crosses either limit. "
+                                      "Conversions are slower while this is on.")
+        profiling_help_label.setStyleSheet("color: gray; font-size: 12px;")
+        profiling_help_label.setWordWrap(True)
+        profiling_layout.addWidget(profiling_help_label)
+
+        profiling_group.setLayout(profiling_layout)
+        main_layout.addWidget(profiling_group)
+
+        # Buttons
+        button_layout = QHBoxLayout()
+        self.save_btn = QPushButton("Save")
+        self.save_btn.clicked.connect(self.save_settings)
+        button_layout.addWidget(self.save_btn)
+
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.reject)
+        self.cancel_btn.setStyleSheet("background-color: #ff3b30;")
+        button_layout.addWidget(self.cancel_btn)
+
+        main_layout.addLayout(button_layout)
+
+        self.setLayout(main_layout)
+
+    def load_settings(self):
+        self.workers_spin.setValue(int(self.db.get_setting('worker_count', 0)))
+        self.job_memory_spin.setValue(int(self.db.get_setting('job_memory_mb', DEFAULT_JOB_MEMORY_MB) or 0))
+        self.memory_budget_spin.setValue(
+            int(self.db.get_setting('memory_budget_mb', DEFAULT_MEMORY_BUDGET_MB) or 0))
+
+        watch_mode_index = self.watch_mode_combo.findText(self.db.get_setting('watch_mode', WATCH_MODE_AUTO))
+        if watch_mode_index >= 0:
+            self.watch_mode_combo.setCurrentIndex(watch_mode_index)
+
+        self.stability_spin.setValue(int(self.db.get_setting('stability_checks', DEFAULT_STABILITY_CHECKS)))
+
+        self.cache_checkbox.setChecked(self.db.get_setting('output_cache_enabled', '0') == '1')
+        self.cache_size_spin.setValue(int(self.db.get_setting('output_cache_size_mb', DEFAULT_CACHE_SIZE_MB)))
+        self.cache_size_spin.setEnabled(self.cache_checkbox.isChecked())
+
+        self.metrics_checkbox.setChecked(self.db.get_setting('metrics_enabled', '0') == '1')
+        self.metrics_port_spin.setValue(int(self.db.get_setting('metrics_port', 0) or 0))
+        self.metrics_file_edit.setText(self.db.get_setting('metrics_textfile', '') or '')
+        self.update_metrics_fields(self.metrics_checkbox.isChecked())
+
+        self.profiling_checkbox.setChecked(self.db.get_setting('profiling_enabled', '0') == '1')
+        self.profiling_seconds_spin.setValue(
+            int(float(self.db.get_setting('profiling_min_seconds', DEFAULT_MIN_SECONDS))))
+        self.profiling_memory_spin.setValue(
+            int(self.db.get_setting('profiling_min_memory_mb', DEFAULT_MIN_MEMORY_MB)))
+        self.update_profiling_fields(self.profiling_checkbox.isChecked())
+
+    def update_profiling_fields(self, enabled):
+        self.profiling_seconds_spin.setEnabled(enabled)
+        self.profiling_memory_spin.setEnabled(enabled)
+
+    def update_metrics_fields(self, enabled):
+        self.metrics_port_spin.setEnabled(enabled)
+        self.metrics_file_edit.setEnabled(enabled)
+
+    def save_settings(self):
+        self.db.set_setting('worker_count', self.workers_spin.value())
+        self.db.set_setting('job_memory_mb', self.job_memory_spin.value())
+        self.db.set_setting('memory_budget_mb', self.memory_budget_spin.value())
+        self.db.set_setting('watch_mode', self.watch_mode_combo.currentText())
+        self.db.set_setting('stability_checks', self.stability_spin.value())
+        self.db.set_setting('output_cache_enabled', 1 if self.cache_checkbox.isChecked() else 0)
+        self.db.set_setting('output_cache_size_mb', self.cache_size_spin.value())
+        self.db.set_setting('metrics_enabled', 1 if self.metrics_checkbox.isChecked() else 0)
+        self.db.set_setting('metrics_port', self.metrics_port_spin.value())
+        self.db.set_setting('metrics_textfile', self.metrics_file_edit.text().strip())
+        self.db.set_setting('profiling_enabled', 1 if self.profiling_checkbox.isChecked() else 0)
+        self.db.set_setting('profiling_min_seconds', self.profiling_seconds_spin.value())
+        self.db.set_setting('profiling_min_memory_mb', self.profiling_memory_spin.value())
+        self.accept()
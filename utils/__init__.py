@@ -1,5 +1,14 @@
 from .image_processor import ImageProcessor
-from .folder_watcher import FolderWatcher
+from .conversion_pool import ConversionPool
+from .watch_loop import WatchLoop
 from .style_helper import StyleHelper
 
-__all__ = ['ImageProcessor', 'FolderWatcher', 'StyleHelper']
\ No newline at end of file
+__all__ = ['ImageProcessor', 'FolderWatcher', 'ConversionPool', 'WatchLoop', 'StyleHelper']
+
+def __getattr__(name):
+    # FolderWatcher is a QThread; import it on first use so the headless
+    # runner and conversion worker processes never load PyQt6
+    if name == 'FolderWatcher':
+        from .folder_watcher import FolderWatcher
+        return FolderWatcher
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
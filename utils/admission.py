@@ -0,0 +1,186 @@
+import threading
+from collections import deque
+from itertools import islice
+from typing import Callable, List, Optional
+
+from PIL import Image
+
+from utils.tiling import StripReader, decoded_bytes, open_large_tiff
+
+DEFAULT_MEMORY_BUDGET_MB = 4096
+WORKING_COPIES = 2  # the decoded source plus one full-size working copy
+MAX_BYPASSES = 8  # later jobs admitted ahead of a waiting one before it holds them back
+LOOKAHEAD = 8  # waiting jobs per profile considered for a start, from the front of its queue
+DEFAULT_PRIORITY = 1
+MAX_PRIORITY = 10
+
+
+def memory_budget(db) -> Optional[int]:
+    """Memory budget for all running conversions in bytes from the app settings, or None for no budget"""
+    budget_mb = int(db.get_setting('memory_budget_mb', DEFAULT_MEMORY_BUDGET_MB) or 0)
+    return budget_mb * 1024 * 1024 if budget_mb > 0 else None
+
+
+def estimate_footprint(source_path: str, memory_limit: Optional[int] = None) -> int:
+    """Memory a conversion of source_path is expected to need, from the image header alone.
+
+    Sources that will be streamed in bands (see utils.tiling) need about
+    memory_limit. Unreadable files are estimated at 0; they fail without
+    decoding anything.
+    """
+    try:
+        with Image.open(source_path) as img:
+            footprint = decoded_bytes(img.mode, img.size) * WORKING_COPIES
+            if memory_limit and footprint > memory_limit and StripReader.supports(img):
+                return memory_limit
+            return footprint
+    except Image.DecompressionBombError:
+        img = open_large_tiff(source_path) if memory_limit else None
+        if img is None:
+            return 0
+        img.close()
+        return memory_limit
+    except Exception:
+        return 0
+
+
+class ProfileQueue:
+    """Jobs of one profile waiting to start, with its share of the workers"""
+
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.jobs = deque()  # [footprint, times overtaken, start callable]
+        self.finish_time = 0.0  # virtual time at which this queue's next job is due
+
+
+class AdmissionQueue:
+    """Starts jobs fairly across profiles, while their estimated memory fits within a budget.
+
+    Each profile has its own queue, and a job starts only while fewer than
+    max_running are running. Queues are served by weighted fair queueing:
+    a profile of priority 3 starts three jobs for every one started for a
+    priority 1 profile, while both have jobs waiting, and a profile that
+    was idle cannot save up turns. A bulk load on one profile therefore
+    only delays another profile's files by the jobs already running.
+
+    Jobs that do not fit in the memory budget wait, and a job close behind
+    them (within LOOKAHEAD of the front of any profile's queue) that does
+    fit starts ahead of them, so small files keep flowing while a large
+    one waits for memory. Once a waiting job has been overtaken
+    MAX_BYPASSES times, nothing more overtakes it until it has started.
+    A job larger than the whole budget starts once nothing else is running.
+    With a budget of None memory is not limited.
+    """
+
+    def __init__(self, budget: Optional[int] = None, max_running: Optional[int] = None):
+        self.budget = budget
+        self.max_running = max_running
+        self.lock = threading.Lock()
+        self.drained = threading.Condition(self.lock)
+        self.queues = {}  # profile id -> ProfileQueue
+        self.virtual_time = 0.0
+        self.in_use = 0
+        self.running = 0
+
+    def submit(self, key, weight: int, footprint: int, start: Callable[[], None]):
+        """Queue a job for profile key; start() is called once it may run"""
+        with self.lock:
+            queue = self.queues.get(key)
+            if queue is None:
+                queue = self.queues[key] = ProfileQueue(weight)
+            queue.weight = max(1, weight)  # Follows edits to the profile
+            if not queue.jobs:
+                # An idle queue rejoins at the current virtual time
+                queue.finish_time = max(queue.finish_time, self.virtual_time)
+            queue.jobs.append([footprint, 0, start])
+            ready = self.take_ready()
+        self.start_all(ready)
+
+    def release(self, footprint: int):
+        """Return a finished job's memory and start the waiting jobs that can now run"""
+        with self.lock:
+            self.in_use -= footprint
+            self.running -= 1
+            ready = self.take_ready()
+        self.start_all(ready)
+
+    def releaser(self, footprint: int, jobs: int) -> Callable[[], None]:
+        """A release callable for a footprint shared by several jobs, releasing after the last one"""
+        remaining = [jobs]
+        lock = threading.Lock()
+
+        def release():
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.release(footprint)
+        return release
+
+    def set_limits(self, budget: Optional[int], max_running: Optional[int]):
+        with self.lock:
+            self.budget = budget
+            self.max_running = max_running
+            ready = self.take_ready()
+        self.start_all(ready)
+
+    def clear(self) -> int:
+        """Drop every waiting job without starting it and return how many there were"""
+        with self.lock:
+            dropped = 0
+            for queue in self.queues.values():
+                dropped += len(queue.jobs)
+                queue.jobs.clear()
+            self.drained.notify_all()
+        return dropped
+
+    def join(self):
+        """Wait until every waiting job has been started"""
+        with self.lock:
+            while any(queue.jobs for queue in self.queues.values()):
+                self.drained.wait()
+
+    def fits(self, footprint: int) -> bool:
+        return self.budget is None or self.running == 0 or self.in_use + footprint <= self.budget
+
+    def take_ready(self) -> List[Callable[[], None]]:
+        """Remove and account for the waiting jobs that can start now. Called with the lock held."""
+        ready = []
+        while self.max_running is None or self.running < self.max_running:
+            job = self.next_job()
+            if job is None:
+                break
+            self.in_use += job[0]
+            self.running += 1
+            ready.append(job[2])
+        if not any(queue.jobs for queue in self.queues.values()):
+            self.drained.notify_all()
+        return ready
+
+    def next_job(self):
+        """Take the next job that fits, from the queues in order of when their turn is due"""
+        overtaken = []
+        order = sorted((queue for queue in self.queues.values() if queue.jobs),
+                       key=lambda queue: queue.finish_time)
+        for queue in order:
+            # Only the front of each queue, so a start costs the same however many jobs wait
+            for job in islice(queue.jobs, LOOKAHEAD):
+                if self.fits(job[0]):
+                    queue.jobs.remove(job)
+                    self.virtual_time = queue.finish_time
+                    queue.finish_time += 1.0 / queue.weight
+                    for earlier in overtaken:
+                        earlier[1] += 1
+                    return job
+                if job[1] >= MAX_BYPASSES:
+                    return None
+                overtaken.append(job)
+        return None
+
+    @staticmethod
+    def start_all(ready: List[Callable[[], None]]):
+        for start in ready:
+            try:
+                start()
+            except Exception as e:
+                print(f"Error starting conversion: {e}")
@@ -0,0 +1,200 @@
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from database.db_manager import Database
+from database.history_writer import HistoryWriter
+from utils.admission import memory_budget
+from utils.conversion_pool import ConversionPool
+from utils.image_processor import ImageProcessor
+from utils.output_cache import output_cache_config
+from utils.profiling import profiling_config
+from utils.seen_index import SeenFileIndex
+from utils.tiling import job_memory_limit
+from utils.watch_loop import IMAGE_EXTENSIONS
+
+BACKFILL_BATCH_SIZE = 1000  # processed_files rows committed per transaction
+BACKFILL_FLUSH_INTERVAL = 2.0  # seconds
+SEQUENCE_BLOCK = 256  # {seq} numbers reserved per database round trip
+PROGRESS_INTERVAL = 2.0  # seconds between progress reports
+QUEUE_DEPTH = 4  # jobs queued per worker, so the pool never holds the whole backlog
+
+
+def iter_image_files(folder: str, recursive: bool = False) -> Iterator[str]:
+    """Yield image files in folder (and its subfolders when recursive) using os.scandir"""
+    folders = [folder]
+    while folders:
+        current = folders.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                folders.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+
+                    if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield entry.path
+        except OSError as e:
+            print(f"Error scanning {current}: {e}")
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Backfill:
+    """Converts the images already sitting in a profile's source folder.
+
+    The watcher hands files over one at a time as it finds them; a backfill
+    instead lists the whole folder up front, skips everything already in
+    processed_files, and keeps every worker busy until the backlog is done.
+    Submission is throttled to QUEUE_DEPTH jobs per worker and results are
+    committed BACKFILL_BATCH_SIZE rows per transaction. on_progress is
+    called from the thread running run() with a dict of done, failed,
+    total, rate (files per second) and eta (seconds, or None until known).
+    """
+
+    def __init__(self, db: Database, profile: Dict[str, Any], max_workers: Optional[int] = None,
+                 recursive: bool = False,
+                 on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 seen_index: Optional[SeenFileIndex] = None):
+        self.db = db
+        self.profile = profile
+        self.recursive = recursive
+        self.on_progress = on_progress
+        self.seen_index = seen_index
+        self.conversion_pool = ConversionPool(max_workers=max_workers, on_result=self.on_result,
+                                              db_path=db.db_path,
+                                              output_cache=output_cache_config(db),
+                                              profiling=profiling_config(db),
+                                              memory_limit=job_memory_limit(db),
+                                              memory_budget=memory_budget(db))
+        self.history_writer = HistoryWriter(
+            db.db_path,
+            batch_size=BACKFILL_BATCH_SIZE,
+            flush_interval=BACKFILL_FLUSH_INTERVAL
+        )
+        self.slots = threading.Semaphore(self.conversion_pool.max_workers * QUEUE_DEPTH)
+        self.lock = threading.Lock()
+        self.running = False
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+        self.start_time = time.monotonic()
+
+    def find_files(self) -> List[str]:
+        """List the source files this profile has not processed yet, in name order"""
+        if self.seen_index is None:
+            self.seen_index = SeenFileIndex()
+            self.seen_index.build(self.db)
+
+        profile_id = self.profile['id']
+        files = [
+            path for path in iter_image_files(self.profile['source_folder'], self.recursive)
+            if not self.seen_index.contains(self.db, profile_id, path)
+        ]
+        files.sort()
+        return files
+
+    def run(self) -> Dict[str, Any]:
+        """Convert every unprocessed file and return the final progress"""
+        self.running = True
+        files = self.find_files()
+        self.total = len(files)
+        self.start_time = time.monotonic()
+        if not files:
+            return self.progress()
+
+        uses_sequence = ImageProcessor.uses_sequence(self.profile['filename_pattern'])
+        next_sequence = end_sequence = 0
+        last_report = self.start_time
+
+        self.history_writer.start()
+        self.conversion_pool.start()
+        try:
+            for index, path in enumerate(files):
+                while self.running and not self.slots.acquire(timeout=0.5):
+                    last_report = self.report(last_report)
+                if not self.running:
+                    break
+
+                sequence_num = 0
+                if uses_sequence:
+                    if next_sequence == end_sequence:
+                        block = min(SEQUENCE_BLOCK, self.total - index)
+                        next_sequence = self.db.allocate_sequence(self.profile['id'], block)
+                        end_sequence = next_sequence + block
+                    sequence_num = next_sequence
+                    next_sequence += 1
+
+                self.conversion_pool.submit(self.profile, path, sequence_num=sequence_num)
+                last_report = self.report(last_report)
+
+            while self.running and self.finished() < self.total:
+                time.sleep(0.2)
+                last_report = self.report(last_report)
+        finally:
+            self.conversion_pool.shutdown(wait=True, cancel_pending=True)
+            self.history_writer.stop()
+            self.running = False
+
+        progress = self.progress()
+        if self.on_progress:
+            self.on_progress(progress)
+        return progress
+
+    def stop(self):
+        """Stop after the conversions already running; the rest are left for the next run"""
+        self.running = False
+
+    def on_result(self, result):
+        """Called from a conversion worker thread"""
+        self.slots.release()
+        if result['destination_path']:
+            self.history_writer.log(result['profile_id'], result['source_path'],
+                                    result['destination_path'], result['content_hash'])
+            with self.lock:
+                self.done += 1
+        else:
+            with self.lock:
+                self.failed += 1
+            print(result['error'])
+
+    def finished(self) -> int:
+        with self.lock:
+            return self.done + self.failed
+
+    def progress(self) -> Dict[str, Any]:
+        with self.lock:
+            done, failed = self.done, self.failed
+        elapsed = time.monotonic() - self.start_time
+        rate = (done + failed) / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - done - failed
+        return {
+            'profile_id': self.profile['id'],
+            'done': done,
+            'failed': failed,
+            'total': self.total,
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': remaining / rate if rate > 0 else None
+        }
+
+    def report(self, last_report: float) -> float:
+        now = time.monotonic()
+        if self.on_progress is None or now - last_report < PROGRESS_INTERVAL:
+            return last_report
+        self.on_progress(self.progress())
+        return now
@@ -0,0 +1,596 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from PIL import Image
+
+from utils import metrics
+from utils.admission import DEFAULT_PRIORITY, AdmissionQueue, estimate_footprint
+from utils.image_processor import ImageProcessor
+from utils.pipeline import run_shared_prefixes
+from utils.dedupe import DUPLICATE_OFF, DUPLICATE_SKIP, file_fingerprint, find_duplicate, link_output
+from utils.output_cache import get_output_cache
+from utils.metrics import ConversionMetrics
+from utils.profiling import profiled
+from utils.tiling import decoded_bytes
+
+# Values of the profile's conversion_engine setting
+ENGINE_THREAD = 'Thread'
+ENGINE_PROCESS = 'Process'
+CONVERSION_ENGINES = [ENGINE_THREAD, ENGINE_PROCESS]
+
+# Jobs started per worker; the rest wait in the per-profile queues so a
+# newly submitted file is not stuck behind everything handed out before it
+JOBS_PER_WORKER = 2
+
+
+def default_worker_count() -> int:
+    return os.cpu_count() or 1
+
+
+def convert_file(profile: Dict[str, Any], source_path: str, sequence_num: int = 0,
+                 db_path: Optional[str] = None,
+                 output_cache: Optional[Tuple[str, int]] = None,
+                 memory_limit: Optional[int] = None) -> Dict[str, Any]:
+    """Process and save a single image. Runs on a pool worker, never on the GUI thread.
+
+    Only the profile dict and paths cross the worker boundary, so this works
+    unchanged in worker threads and in worker processes.
+
+    Before decoding, the source is fingerprinted if the profile dedupes by
+    content or output_cache (cache_dir, max_bytes) is given. An earlier
+    output of identical bytes (looked up read-only in the database at
+    db_path) or a cached output for the same bytes and settings is then
+    reused instead of decoding and encoding again. Sources needing more
+    than memory_limit bytes decoded are processed in bands.
+    """
+    start = time.perf_counter()
+    processor = ImageProcessor(profile, memory_limit)
+
+    content_hash = fingerprint(source_path) if needs_fingerprint(profile, output_cache) else None
+    result, cache, cache_key = reuse_output(
+        processor, source_path, sequence_num, content_hash, start, db_path, output_cache
+    )
+    if result:
+        return result
+    return convert_single(processor, source_path, sequence_num, content_hash, cache, cache_key, start)
+
+
+def convert_single(processor: ImageProcessor, source_path: str, sequence_num: int,
+                   content_hash: Optional[str], cache, cache_key: Optional[str],
+                   start: float) -> Dict[str, Any]:
+    """Decode, process and save a source for one profile, once no earlier output could be reused"""
+    img = processor.process_image(source_path)
+    if img is None:
+        return {'destination_path': None, 'error': f"Failed to process {source_path}",
+                'content_hash': content_hash}
+
+    return save_output(processor, img, source_path, sequence_num, content_hash,
+                       cache, cache_key, start, time.perf_counter())
+
+
+def finish_conversion(processor: ImageProcessor, img, source_size, start_op: int,
+                      source_path: str, sequence_num: int, content_hash: Optional[str],
+                      cache, cache_key: Optional[str], start: float) -> Dict[str, Any]:
+    """Run the rest of a profile's pipeline on a shared decoded image and save it"""
+    try:
+        img = processor.pipeline.run(img, source_size, start=start_op)
+    except Exception as e:
+        print(f"Error processing image {source_path}: {e}")
+        return {'destination_path': None, 'error': f"Failed to process {source_path}",
+                'content_hash': content_hash}
+
+    return save_output(processor, img, source_path, sequence_num, content_hash,
+                       cache, cache_key, start, time.perf_counter())
+
+
+def needs_fingerprint(profile: Dict[str, Any], output_cache: Optional[Tuple[str, int]]) -> bool:
+    return (profile.get('duplicate_mode') or DUPLICATE_OFF) != DUPLICATE_OFF or bool(output_cache)
+
+
+def fingerprint(source_path: str) -> Optional[str]:
+    try:
+        with metrics.stage('fingerprint'):
+            return file_fingerprint(source_path)
+    except OSError as e:
+        print(f"Error fingerprinting {source_path}: {e}")
+        return None
+
+
+def reuse_output(processor: ImageProcessor, source_path: str, sequence_num: int,
+                 content_hash: Optional[str], start: float, db_path: Optional[str],
+                 output_cache: Optional[Tuple[str, int]]):
+    """Try to satisfy a conversion from an earlier output of identical source bytes.
+
+    Returns (result, cache, cache_key). result is None when the source has
+    to be converted; cache and cache_key are then where to store the output.
+    """
+    profile = processor.profile
+    if not content_hash:
+        return None, None, None
+
+    duplicate_mode = profile.get('duplicate_mode') or DUPLICATE_OFF
+    if duplicate_mode != DUPLICATE_OFF and db_path:
+        try:
+            existing_path = find_duplicate(db_path, profile['id'], content_hash)
+        except Exception as e:
+            print(f"Error checking {source_path} for duplicates: {e}")
+            existing_path = None
+
+        if existing_path:
+            if duplicate_mode == DUPLICATE_SKIP:
+                dest_path = existing_path
+            else:
+                dest_path = processor.destination_path(source_path, sequence_num=sequence_num)
+                if not link_output(existing_path, dest_path):
+                    dest_path = None
+            if dest_path:
+                return reused_result(dest_path, content_hash, start, duplicate_of=existing_path), None, None
+
+    if not output_cache:
+        return None, None, None
+
+    cache = get_output_cache(*output_cache)
+    cache_key = cache.make_key(content_hash, profile)
+    dest_path = processor.destination_path(source_path, sequence_num=sequence_num)
+    os.makedirs(profile['destination_folder'], exist_ok=True)
+    with metrics.stage('cache'):
+        hit = cache.fetch(cache_key, dest_path)
+    if hit:
+        return reused_result(dest_path, content_hash, start, cache_hit=True), None, None
+    return None, cache, cache_key
+
+
+def save_output(processor: ImageProcessor, img, source_path: str, sequence_num: int,
+                content_hash: Optional[str], cache, cache_key: Optional[str],
+                start: float, processed: float) -> Dict[str, Any]:
+    dest_path = processor.save_image(img, source_path, sequence_num=sequence_num)
+    saved = time.perf_counter()
+    if not dest_path:
+        return {'destination_path': None, 'error': "Failed to save processed image",
+                'content_hash': content_hash}
+
+    if cache:
+        with metrics.stage('cache'):
+            cache.store(cache_key, dest_path)
+
+    return {
+        'destination_path': dest_path,
+        'error': None,
+        'content_hash': content_hash,
+        'duplicate_of': None,
+        'cache_hit': False,
+        'timings': {
+            'process': processed - start,
+            'save': saved - processed,
+            'total': time.perf_counter() - start
+        }
+    }
+
+
+def reused_result(dest_path: str, content_hash: str, start: float,
+                  duplicate_of: Optional[str] = None, cache_hit: bool = False) -> Dict[str, Any]:
+    """Result for a conversion satisfied without decoding the source"""
+    return {
+        'destination_path': dest_path,
+        'error': None,
+        'content_hash': content_hash,
+        'duplicate_of': duplicate_of,
+        'cache_hit': cache_hit,
+        'timings': {'process': 0.0, 'save': 0.0, 'total': time.perf_counter() - start}
+    }
+
+
+def timed(step: Callable[..., Dict[str, Any]], *args) -> Dict[str, Any]:
+    """Run a conversion step with stage timing on, adding the stage times to its result's timings"""
+    stage_timings = metrics.start_timing()
+    try:
+        result = step(*args)
+    finally:
+        metrics.stop_timing()
+    result.setdefault('timings', {}).update(stage_timings)
+    return result
+
+
+class ConversionPool:
+    """Bounded pool of conversion workers.
+
+    Jobs are submitted with submit() and each finished job is reported to
+    on_result as a dict with profile_id, source_path, destination_path,
+    error, content_hash, duplicate_of, cache_hit and timings. on_result is
+    called from a worker thread, so GUI callers should route it through a
+    Qt signal.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None,
+                 on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 db_path: Optional[str] = None,
+                 output_cache: Optional[Tuple[str, int]] = None,
+                 metrics: Optional[ConversionMetrics] = None,
+                 profiling: Optional[Tuple[str, float, int]] = None,
+                 memory_limit: Optional[int] = None,
+                 memory_budget: Optional[int] = None):
+        self.max_workers = max_workers or default_worker_count()
+        self.on_result = on_result
+        self.db_path = db_path  # Only needed by profiles that dedupe by content
+        self.output_cache = output_cache  # (cache_dir, max_bytes) of the shared output cache, or None
+        # Workers time each stage and every result is recorded here; None times nothing extra
+        self.metrics = metrics
+        self.profiling = profiling  # (capture_dir, min_seconds, min_bytes) for slow conversions, or None
+        self.memory_limit = memory_limit  # Decoded bytes above which a source is processed in bands
+        # Jobs wait per profile and start a few per worker, taking turns by profile priority.
+        # memory_budget in bytes also holds them back until their estimated memory fits.
+        self.admission = AdmissionQueue(memory_budget, self.max_workers * JOBS_PER_WORKER)
+        self.executor = None  # Thread engine profiles
+        # Process engine profiles, so enhancement-heavy work is not serialised on the GIL
+        self.process_executor = None
+        # Reads headers for the memory estimates, in submission order, off the caller's thread
+        self.estimator = None
+        self.closing = False  # set while shutdown() runs; jobs starting then are dropped
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="tbice-convert"
+            )
+
+    def get_process_executor(self):
+        """Create the process pool on first use; most setups never need it"""
+        if self.process_executor is None:
+            # Spawn rather than fork: forking a process that runs Qt threads is unsafe
+            self.process_executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self.process_executor
+
+    def submit_process(self, *args):
+        """Submit to the process pool, replacing the pool if one of its workers has died"""
+        executor = self.get_process_executor()
+        try:
+            return executor.submit(*args)
+        except BrokenProcessPool:
+            # A worker crashed or was killed (e.g. out of memory); a broken pool takes no more jobs
+            if self.process_executor is executor:
+                self.process_executor = None
+            executor.shutdown(wait=False)
+            return self.get_process_executor().submit(*args)
+
+    def resize(self, max_workers: Optional[int]):
+        """Change the worker count. Jobs already queued finish on the old workers."""
+        max_workers = max_workers or default_worker_count()
+        if max_workers == self.max_workers:
+            return
+
+        self.max_workers = max_workers
+        self.admission.set_limits(self.admission.budget, max_workers * JOBS_PER_WORKER)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self.start()
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=False)
+            self.process_executor = None
+
+    def set_memory_budget(self, memory_budget: Optional[int]):
+        """Change the memory budget. Waiting jobs that now fit start at once."""
+        self.admission.set_limits(memory_budget, self.admission.max_running)
+
+    def with_footprint(self, queue_jobs, profiles, source_path, *args):
+        """Call queue_jobs(*args, footprint, submitted) once the source's memory estimate is known.
+
+        The estimate opens the file's header, which may be slow on network
+        shares, so it is read on a single side thread; that keeps files
+        queued in the order they were submitted. Without a budget nothing
+        is read.
+        """
+        submitted = time.perf_counter()
+        if self.admission.budget is None:
+            queue_jobs(*args, 0, submitted)
+            return
+
+        def estimate_and_queue():
+            try:
+                queue_jobs(*args, estimate_footprint(source_path, self.memory_limit), submitted)
+            except Exception as e:
+                for profile in profiles:
+                    self._report({'destination_path': None, 'content_hash': None,
+                                  'error': f"Error processing {source_path}: {e}"},
+                                 profile['id'], source_path)
+
+        if self.estimator is None:
+            self.estimator = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tbice-estimate")
+        self.estimator.submit(estimate_and_queue)
+
+    def submit(self, profile: Dict[str, Any], source_path: str, sequence_num: int = 0):
+        self.with_footprint(self._queue, [profile], source_path, profile, source_path, sequence_num)
+
+    def _queue(self, profile, source_path, sequence_num, footprint, submitted):
+        priority = profile.get('priority') or DEFAULT_PRIORITY
+        self.admission.submit(profile['id'], priority, footprint, lambda: self._start(
+            profile, source_path, sequence_num, submitted, lambda: self.admission.release(footprint)
+        ))
+
+    def _start(self, profile, source_path, sequence_num, submitted, release):
+        args = self._wrap(profile['id'], source_path, convert_file,
+                          profile, source_path, sequence_num, self.db_path, self.output_cache,
+                          self.memory_limit)
+        try:
+            if profile.get('conversion_engine') == ENGINE_PROCESS:
+                future = self.submit_process(*args)
+            else:
+                self.start()
+                future = self.executor.submit(*args)
+        except Exception as e:
+            if self.closing:
+                # The pool was shut down while the job waited for its turn
+                release()
+                return
+            self._report({'destination_path': None, 'error': f"Error processing {source_path}: {e}",
+                          'content_hash': None}, profile['id'], source_path, release=release)
+            return
+        future.add_done_callback(
+            lambda f: self._job_finished(f, profile['id'], source_path, submitted, release=release)
+        )
+
+    def submit_group(self, profiles: List[Dict[str, Any]], source_path: str,
+                     sequence_nums: List[int]):
+        """Convert one source with several profiles, decoding it only once.
+
+        Thread engine profiles share a single decode, and the leading
+        operations their pipelines have in common run once on it; each
+        profile's remaining operations and encode then run as separate jobs
+        so the outputs are produced in parallel. Process engine profiles
+        cannot share an in-memory image and are submitted one by one, as
+        are all of them when the source is over the memory limit. The shared
+        decode is queued as a single job, under its highest priority profile.
+        """
+        self.with_footprint(self._queue_group, profiles, source_path, profiles, source_path, sequence_nums)
+
+    def _queue_group(self, profiles, source_path, sequence_nums, footprint, submitted):
+        shared = []
+        for profile, sequence_num in zip(profiles, sequence_nums):
+            if profile.get('conversion_engine') == ENGINE_PROCESS:
+                self._queue(profile, source_path, sequence_num, footprint, submitted)
+            else:
+                shared.append((profile, sequence_num))
+
+        if len(shared) == 1:
+            self._queue(shared[0][0], source_path, shared[0][1], footprint, submitted)
+        elif shared:
+            if self.memory_limit and footprint >= self.memory_limit:
+                # Split into one banded job per profile, each using up to the limit
+                footprint *= len(shared)
+            lead = max((profile for profile, _ in shared),
+                       key=lambda profile: profile.get('priority') or DEFAULT_PRIORITY)
+            priority = lead.get('priority') or DEFAULT_PRIORITY
+            self.admission.submit(lead['id'], priority, footprint, lambda: self._start_group(
+                shared, source_path, submitted, self.admission.releaser(footprint, len(shared))
+            ))
+
+    def _start_group(self, shared, source_path, submitted, release):
+        self.start()
+        args = (self._fan_out, shared, source_path, submitted, release)
+        if self.profiling:
+            # Profiles the shared decode; each job's remaining steps are profiled on their own
+            args = (profiled, self.profiling, [profile['id'] for profile, _ in shared], source_path) + args
+        try:
+            future = self.executor.submit(*args)
+        except Exception as e:
+            for profile, _ in shared:
+                if self.closing:
+                    release()
+                else:
+                    self._report({'destination_path': None, 'content_hash': None,
+                                  'error': f"Error processing {source_path}: {e}"},
+                                 profile['id'], source_path, release=release)
+            return
+        future.add_done_callback(lambda f: self._fan_out_finished(f, shared, source_path, release))
+
+    def _wrap(self, profile_id, source_path, step, *args):
+        """Call for executor.submit() that runs step with stage timing and profiling, if enabled"""
+        if self.metrics:
+            args = (step,) + args
+            step = timed
+        if self.profiling:
+            args = (self.profiling, profile_id, source_path, step) + args
+            step = profiled
+        return (step,) + args
+
+    def _fan_out(self, jobs, source_path, submitted, release):
+        """Worker side of submit_group: reuse earlier outputs, decode once, hand off the rest"""
+        # Stages run here are shared by every job and counted for each of them
+        shared_timings = metrics.start_timing() if self.metrics else None
+        try:
+            self._fan_out_jobs(jobs, source_path, submitted, shared_timings, release)
+        finally:
+            if shared_timings is not None:
+                metrics.stop_timing()
+
+    def _fan_out_jobs(self, jobs, source_path, submitted, shared_timings, release):
+        start = time.perf_counter()
+        processors = [ImageProcessor(profile, self.memory_limit) for profile, _ in jobs]
+
+        content_hash = None
+        if any(needs_fingerprint(profile, self.output_cache) for profile, _ in jobs):
+            content_hash = fingerprint(source_path)
+
+        remaining = []
+        for processor, (profile, sequence_num) in zip(processors, jobs):
+            profile_hash = content_hash if needs_fingerprint(profile, self.output_cache) else None
+            result, cache, cache_key = reuse_output(
+                processor, source_path, sequence_num, profile_hash, start,
+                self.db_path, self.output_cache
+            )
+            if result:
+                self._report(result, profile['id'], source_path, submitted, start, shared_timings, release)
+            else:
+                remaining.append((processor, sequence_num, profile_hash, cache, cache_key))
+
+        if not remaining:
+            return
+
+        try:
+            img, source_size = self._open_shared(source_path, [job[0] for job in remaining])
+            if img is None:
+                # Too large to share a full decode; each profile processes it in bands instead
+                for processor, sequence_num, profile_hash, cache, cache_key in remaining:
+                    self._hand_off(convert_single, (processor, source_path, sequence_num, profile_hash,
+                                                    cache, cache_key, start),
+                                   processor.profile['id'], source_path, submitted, start, shared_timings,
+                                   release)
+                return
+            img, source_size = ImageProcessor.decode_shared(source_path, [job[0] for job in remaining],
+                                                            img, source_size)
+            prepared = run_shared_prefixes([job[0].pipeline for job in remaining], img, source_size)
+        except Exception as e:
+            print(f"Error processing image {source_path}: {e}")
+            for processor, _, profile_hash, _, _ in remaining:
+                self._report({'destination_path': None, 'error': f"Failed to process {source_path}",
+                              'content_hash': profile_hash}, processor.profile['id'], source_path,
+                             submitted, start, shared_timings, release)
+            return
+
+        for (processor, sequence_num, profile_hash, cache, cache_key), (prefix_img, prefix_size, start_op) \
+                in zip(remaining, prepared):
+            args = (processor, prefix_img, prefix_size, start_op, source_path, sequence_num,
+                    profile_hash, cache, cache_key, start)
+            self._hand_off(finish_conversion, args, processor.profile['id'], source_path,
+                           submitted, start, shared_timings, release)
+
+    def _open_shared(self, source_path, processors):
+        """Open a source for a shared decode, or return (None, None) if it is over the memory limit"""
+        try:
+            with metrics.stage('decode'):
+                img, source_size = ImageProcessor.open_shared(source_path, processors)
+        except Image.DecompressionBombError:
+            if not self.memory_limit:
+                raise
+            return None, None
+        if self.memory_limit and decoded_bytes(img.mode, img.size) > self.memory_limit:
+            img.close()
+            return None, None
+        return img, source_size
+
+    def _hand_off(self, step, args, profile_id, source_path, submitted, start, shared_timings, release):
+        """Run one profile's part of a fan-out as its own job"""
+        args = self._wrap(profile_id, source_path, step, *args)
+        future = None
+        for _ in range(2):
+            if self.closing:
+                break
+            self.start()
+            executor = self.executor
+            if executor is None:
+                continue
+            try:
+                future = executor.submit(*args)
+                break
+            except RuntimeError:
+                pass  # Shut down by resize(), which starts a new executor, or by shutdown()
+        if future is None:
+            if self.closing:
+                # The pool was shut down while the source was decoded; dropped like a cancelled job
+                release()
+            else:
+                self._report({'destination_path': None, 'content_hash': None,
+                              'error': f"Error processing {source_path}: the worker pool was shut down"},
+                             profile_id, source_path, submitted, start, shared_timings, release)
+            return
+        future.add_done_callback(
+            lambda f: self._job_finished(f, profile_id, source_path, submitted, start, shared_timings,
+                                         release)
+        )
+
+    def _fan_out_finished(self, future, jobs, source_path, release):
+        if future.cancelled():
+            for _ in jobs:
+                release()
+            return
+        if future.exception() is None:
+            return
+        # Unexpected failure before the outputs were handed off
+        for profile, _ in jobs:
+            self._report({'destination_path': None, 'content_hash': None,
+                          'error': f"Error processing {source_path}: {future.exception()}"},
+                         profile['id'], source_path, release=release)
+
+    def _job_finished(self, future, profile_id, source_path, submitted=None, started=None,
+                      shared_timings=None, release=None):
+        if future.cancelled():
+            if release:
+                release()
+            return
+
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'destination_path': None, 'error': f"Error processing {source_path}: {e}",
+                      'content_hash': None}
+        self._report(result, profile_id, source_path, submitted, started, shared_timings, release)
+
+    def _report(self, result, profile_id, source_path, submitted=None, started=None,
+                shared_timings=None, release=None):
+        result['profile_id'] = profile_id
+        result['source_path'] = source_path
+        if release:
+            # Let waiting jobs start before the result is handled
+            release()
+
+        if self.metrics and submitted is not None:
+            self._record_metrics(result, submitted, started, shared_timings)
+
+        if self.on_result:
+            try:
+                self.on_result(result)
+            except Exception as e:
+                print(f"Error reporting conversion result for {source_path}: {e}")
+
+    def _record_metrics(self, result, submitted, started, shared_timings):
+        """Add a result to the metrics, with the time it spent queued.
+
+        A job's own timings cover only the time it ran, so whatever else
+        passed since submission was spent waiting for a worker (and, for
+        worker processes, passing the job across). Fan-out jobs start their
+        clock when the shared decode starts; started marks that point.
+        """
+        try:
+            timings = result.setdefault('timings', {})
+            for stage, seconds in (shared_timings or {}).items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+
+            elapsed = time.perf_counter() - submitted
+            if started is not None:
+                queue_wait = started - submitted
+            else:
+                queue_wait = max(elapsed - timings.get('total', elapsed), 0.0)
+            self.metrics.record(result, queue_wait)
+        except Exception as e:
+            print(f"Error recording metrics for {result['source_path']}: {e}")
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False):
+        self.closing = True
+        try:
+            self._shutdown(wait, cancel_pending)
+        finally:
+            self.closing = False
+
+    def _shutdown(self, wait, cancel_pending):
+        if self.estimator is not None:
+            self.estimator.shutdown(wait=True, cancel_futures=cancel_pending)
+            self.estimator = None
+        if cancel_pending:
+            self.admission.clear()
+        elif wait:
+            # Jobs still waiting for memory start as running ones finish
+            self.admission.join()
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+            self.executor = None
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+            self.process_executor = None
@@ -0,0 +1,67 @@
+import os
+import hashlib
+import threading
+from typing import Optional
+
+from database.db_manager import Database
+
+# Values of the profile's duplicate_mode setting, for sources whose bytes
+# match a file the profile has already converted
+DUPLICATE_OFF = 'Off'  # convert every file, no fingerprinting
+DUPLICATE_SKIP = 'Skip'  # record the file against the existing output, write nothing
+DUPLICATE_LINK = 'Hard Link'  # hard-link the existing output under the new file's name
+DUPLICATE_MODES = [DUPLICATE_OFF, DUPLICATE_SKIP, DUPLICATE_LINK]
+
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+_local = threading.local()
+
+
+def file_fingerprint(path: str) -> str:
+    """Hash a file's bytes with BLAKE2b, reading it in chunks so memory use stays flat"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(FINGERPRINT_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_lookup_db(db_path: str) -> Database:
+    """Read-only connection for the calling worker thread, opened on first use"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    db = connections.get(db_path)
+    if db is None:
+        db = connections[db_path] = Database(db_path, read_only=True)
+    return db
+
+
+def find_duplicate(db_path: str, profile_id: int, content_hash: str) -> Optional[str]:
+    """Return an existing output the profile made from identical source bytes, if one is still on disk"""
+    for destination_path in get_lookup_db(db_path).find_processed_outputs(profile_id, content_hash):
+        if os.path.isfile(destination_path):
+            return destination_path
+    return None
+
+
+def link_output(existing_path: str, dest_path: str) -> bool:
+    """Hard-link existing_path as dest_path, replacing any file already there"""
+    if os.path.exists(dest_path) and os.path.samefile(existing_path, dest_path):
+        return True
+
+    temp_path = f"{dest_path}.link-tmp"
+    try:
+        os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+        os.link(existing_path, temp_path)
+        os.replace(temp_path, dest_path)
+        return True
+    except OSError as e:
+        # Cross-device destinations and filesystems without hard links
+        print(f"Could not link {existing_path} to {dest_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
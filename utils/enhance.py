@@ -0,0 +1,85 @@
+from PIL import Image, ImageEnhance
+
+# ITU-R 601-2 luma weights, as used by Image.convert("L")
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def _clip(value: float) -> int:
+    # Matches ImageEnhance (Image.blend), which truncates after clipping
+    if value <= 0:
+        return 0
+    if value >= 255:
+        return 255
+    return int(value)
+
+
+def brightness_contrast_lut(img: Image.Image, brightness: float, contrast: float):
+    """Build one per-channel lookup table applying brightness then contrast.
+
+    ImageEnhance.Contrast blends towards the mean grey level of the
+    brightened image. Because luma is a weighted sum of the channels, that
+    mean is worked out from the per-channel histograms of the source pushed
+    through the brightness curve, without building the brightened image.
+    """
+    bright = [_clip(v * brightness) for v in range(256)]
+    if contrast == 1.0:
+        channel_lut = bright
+    else:
+        histogram = img.histogram()
+        pixels = img.width * img.height or 1
+        mean = 0.0
+        for band, weight in enumerate(LUMA_WEIGHTS):
+            band_histogram = histogram[band * 256:(band + 1) * 256]
+            mean += weight * sum(count * bright[v] for v, count in enumerate(band_histogram)) / pixels
+        mean = int(mean + 0.5)
+        channel_lut = [_clip(mean + contrast * (v - mean)) for v in bright]
+
+    lut = channel_lut * 3
+    if img.mode == 'RGBA':
+        lut += list(range(256))  # Alpha is left untouched
+    return lut
+
+
+def saturation_matrix(saturation: float):
+    """Colour matrix for Image.convert("RGB", matrix) equivalent to ImageEnhance.Color"""
+    grey = [(1.0 - saturation) * w for w in LUMA_WEIGHTS]
+    matrix = []
+    for band in range(3):
+        row = list(grey)
+        row[band] += saturation
+        # The -0.5 offset turns the matrix rounding into blend's truncation
+        matrix.extend(row + [-0.5])
+    return tuple(matrix)
+
+
+def apply_enhancements(img: Image.Image, brightness: float = 1.0, contrast: float = 1.0,
+                       sharpness: float = 1.0, saturation: float = 1.0,
+                       point_lut=None) -> Image.Image:
+    """Apply brightness, contrast, saturation and sharpness in as few passes as possible.
+
+    Brightness and contrast are fused into a single Image.point() lookup and
+    saturation becomes a colour-matrix conversion, so the point adjustments
+    cost two passes over the pixels instead of one ImageEnhance blend (with
+    its own full-size degenerate image) per adjustment. Sharpness is a
+    convolution and still uses ImageEnhance. The adjustments are applied in
+    the order of the ImageEnhance chain they replace (brightness, contrast,
+    sharpness, saturation); each clips to 0-255, so reordering them would
+    change the result. img must be RGB or RGBA.
+
+    point_lut overrides the brightness/contrast table, for when img is one
+    band of a larger image whose mean grey level the contrast must use.
+    """
+    if brightness != 1.0 or contrast != 1.0:
+        img = img.point(point_lut or brightness_contrast_lut(img, brightness, contrast))
+
+    if sharpness != 1.0:
+        img = ImageEnhance.Sharpness(img).enhance(sharpness)
+
+    if saturation != 1.0:
+        if img.mode == 'RGB':
+            img = img.convert('RGB', saturation_matrix(saturation))
+        else:
+            # Matrix conversion has no alpha channel support
+            img = ImageEnhance.Color(img).enhance(saturation)
+
+    return img
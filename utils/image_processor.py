@@ -1,161 +1,222 @@
 import os
 from datetime import datetime
-from typing import Dict, Any, Optional
-from PIL import Image, ImageEnhance
+from typing import Dict, Any, List, Optional, Tuple
+from PIL import Image
+from utils import metrics
+from utils.pipeline import get_pipeline, DECODE_FULL, DECODE_QUALITY, DECODE_FAST, DECODE_MODES
+from utils.tiling import decoded_bytes, open_large_tiff, process_large
+
+# Reduced decodes keep at least this many source pixels per output pixel
+DRAFT_MARGINS = {DECODE_QUALITY: 2, DECODE_FAST: 1}
 
 class ImageProcessor:
-    def __init__(self, profile: Dict[str, Any]):
+    def __init__(self, profile: Dict[str, Any], memory_limit: Optional[int] = None):
         self.profile = profile
+        # Compiled once per profile and reused until its settings change
+        self.pipeline = get_pipeline(profile)
+        # Sources needing more than this many bytes decoded are processed in bands
+        self.memory_limit = memory_limit
+    
+    @staticmethod
+    def uses_sequence(pattern: Optional[str]) -> bool:
+        """Return True if a filename pattern contains the {seq} token"""
+        return bool(pattern) and '{seq' in pattern
+    
+    def draft_size(self, source_size: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """Smallest size this profile can decode a source at, or None if it needs full resolution"""
+        margin = DRAFT_MARGINS.get(self.profile.get('decode_mode') or DECODE_QUALITY)
+        target_size = self.pipeline.decode_size(source_size)
+        if not margin or not target_size:
+            return None
+        return target_size[0] * margin, target_size[1] * margin
+    
+    @staticmethod
+    def apply_draft(img: Image.Image, draft_size: Optional[Tuple[int, int]]):
+        """Configure a not-yet-loaded JPEG to decode at a reduced scale if draft_size allows it"""
+        if not draft_size or img.format != 'JPEG':
+            return
         
-    def process_image(self, source_path_or_img) -> Optional[Image.Image]:
-        try:
-            # Check if the input is already a PIL Image object or a file path
-            if isinstance(source_path_or_img, Image.Image):
-                img = source_path_or_img.copy()  # Make a copy to avoid modifying original
-                source_path = "memory image"
-            else:
-                img = Image.open(source_path_or_img)
-                source_path = source_path_or_img
+        # draft() picks the smallest DCT scale (1/2, 1/4, 1/8) that is still at
+        # least the requested size, and does nothing when no reduction fits
+        img.draft(img.mode, draft_size)
+    
+    @staticmethod
+    def open_shared(source_path: str, processors: List['ImageProcessor']) -> Tuple[Image.Image, Tuple[int, int]]:
+        """Open a source for several profiles without decoding it yet.
+
+        The JPEG draft is only reduced as far as every profile allows.
+        Returns the image and the source's full-resolution size, which the
+        profiles' pipelines need to size their resizes.
+        """
+        img = Image.open(source_path)
+        source_size = img.size
+        
+        draft_sizes = [processor.draft_size(source_size) for processor in processors]
+        if all(draft_sizes):
+            ImageProcessor.apply_draft(img, (
+                max(size[0] for size in draft_sizes),
+                max(size[1] for size in draft_sizes)
+            ))
+        return img, source_size
+    
+    @staticmethod
+    def decode_shared(source_path: str, processors: List['ImageProcessor'],
+                      img: Optional[Image.Image] = None,
+                      source_size: Optional[Tuple[int, int]] = None) -> Tuple[Image.Image, Tuple[int, int]]:
+        """Decode a source once for several profiles, as RGB/RGBA.
+
+        Pass img and source_size from open_shared() if the source is
+        already open.
+        """
+        with metrics.stage('decode'):
+            if img is None:
+                img, source_size = ImageProcessor.open_shared(source_path, processors)
             
-            # Convert image mode if needed
             if img.mode not in ('RGB', 'RGBA'):
                 img = img.convert('RGB')
-            
-            # Handle different resize methods
-            resize_width = self.profile.get('resize_width', 0)
-            resize_height = self.profile.get('resize_height', 0)
-            
-            # Resize based on method
-            if resize_width == -1:
-                # Percentage resize (percentage value stored in height field)
-                percentage = resize_height / 100.0
-                if percentage != 1.0:  # Only resize if not 100%
-                    new_width = int(img.width * percentage)
-                    new_height = int(img.height * percentage)
-                    img = img.resize((new_width, new_height), Image.LANCZOS)
-            elif resize_width > 0 and resize_height > 0:
-                # Dimensions resize
-                img = img.resize((resize_width, resize_height), Image.LANCZOS)
-            
-            # Crop
-            if all(v > 0 for v in [
-                    self.profile['crop_left'], self.profile['crop_top'],
-                    self.profile['crop_right'], self.profile['crop_bottom']
-                ]):
-                img = img.crop((
-                    self.profile['crop_left'],
-                    self.profile['crop_top'],
-                    self.profile['crop_right'],
-                    self.profile['crop_bottom']
-                ))
-            
-            # Adjust brightness
-            if self.profile['brightness'] != 1.0:
-                enhancer = ImageEnhance.Brightness(img)
-                img = enhancer.enhance(self.profile['brightness'])
-            
-            # Adjust contrast
-            if self.profile['contrast'] != 1.0:
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(self.profile['contrast'])
-            
-            # Adjust sharpness
-            if self.profile['sharpness'] != 1.0:
-                enhancer = ImageEnhance.Sharpness(img)
-                img = enhancer.enhance(self.profile['sharpness'])
-            
-            # Adjust saturation
-            if self.profile['saturation'] != 1.0:
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(self.profile['saturation'])
-            
-            return img
+            else:
+                img.load()
+        return img, source_size
+        
+    def process_image(self, source_path_or_img) -> Optional[Image.Image]:
+        source_path = "memory image"
+        try:
+            with metrics.stage('decode'):
+                oversized = False
+                # Check if the input is already a PIL Image object or a file path
+                if isinstance(source_path_or_img, Image.Image):
+                    img = source_path_or_img.copy()  # Make a copy to avoid modifying original
+                    from_file = False
+                else:
+                    source_path = source_path_or_img
+                    from_file = True
+                    try:
+                        img = Image.open(source_path)
+                    except Image.DecompressionBombError:
+                        # Too large for Pillow to decode whole; usable only if it can be read in strips
+                        img = open_large_tiff(source_path) if self.memory_limit else None
+                        if img is None:
+                            raise
+                        oversized = True
+                
+                # Remember the full-resolution header size before any reduced
+                # decode changes img.size; resize targets are based on it
+                source_size = img.size
+                if from_file:
+                    self.apply_draft(img, self.draft_size(source_size))
+            
+            # Sources too large to copy freely are processed a band at a time
+            if from_file and self.memory_limit and decoded_bytes(img.mode, img.size) > self.memory_limit:
+                processed = process_large(self.pipeline, img, source_path, source_size, self.memory_limit)
+                if processed is not None:
+                    return processed
+                if oversized:
+                    raise ValueError(f"{img.width}x{img.height} image is too large to crop this way")
+            
+            with metrics.stage('decode'):
+                # Convert image mode if needed; otherwise decode now so the
+                # time is not counted against the first operation
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGB')
+                else:
+                    img.load()
+            
+            # Resize, crop and enhancements, in the order planned for this profile
+            return self.pipeline.run(img, source_size)
             
         except Exception as e:
             print(f"Error processing image {source_path}: {e}")
             return None
     
+    def destination_path(self, source_path: str, sequence_num: int = 0) -> str:
+        """Output path for a source file, from the profile's filename pattern and format"""
+        # Generate filename based on pattern
+        source_filename = os.path.basename(source_path)
+        name, _ = os.path.splitext(source_filename)
+        
+        pattern = self.profile['filename_pattern']
+        if not pattern:
+            pattern = "{name}"
+        
+        filename = pattern.format(
+            name=name,
+            seq=sequence_num,
+            date=datetime.now().strftime('%Y%m%d'),
+            time=datetime.now().strftime('%H%M%S')
+        )
+        
+        # Add extension based on output format
+        output_format = self.profile['output_format'].upper()
+        if output_format == 'JPEG':
+            output_format = 'JPG'
+        
+        return os.path.join(
+            self.profile['destination_folder'],
+            f"{filename}.{output_format.lower()}"
+        )
+    
     def save_image(self, img: Image.Image, source_path: str, sequence_num: int = 0) -> Optional[str]:
         try:
             # Create destination directory if it doesn't exist
             os.makedirs(self.profile['destination_folder'], exist_ok=True)
             
-            # Generate filename based on pattern
-            source_filename = os.path.basename(source_path)
-            name, _ = os.path.splitext(source_filename)
-            
-            pattern = self.profile['filename_pattern']
-            if not pattern:
-                pattern = "{name}"
-            
-            filename = pattern.format(
-                name=name,
-                seq=sequence_num,
-                date=datetime.now().strftime('%Y%m%d'),
-                time=datetime.now().strftime('%H%M%S')
-            )
-            
-            # Add extension based on output format
+            dest_path = self.destination_path(source_path, sequence_num)
             output_format = self.profile['output_format'].upper()
             if output_format == 'JPEG':
                 output_format = 'JPG'
             
-            dest_path = os.path.join(
-                self.profile['destination_folder'],
-                f"{filename}.{output_format.lower()}"
-            )
-            
             # Save with appropriate quality settings
             quality = self.profile.get('quality', 85)
             
-            if output_format in ('JPG', 'JPEG'):
-                img.save(dest_path, format='JPEG', quality=quality)
-            elif output_format == 'PNG':
-                img.save(dest_path, format='PNG', compress_level=int(10 - quality/10))
-            elif output_format == 'WEBP':
-                img.save(dest_path, format='WEBP', quality=quality)
-            elif output_format == 'ICO':
-                # For ICO format, we need to ensure it's in RGBA mode
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                # Ensure image size is appropriate for ICO format
-                # ICO works best with standard sizes: 16x16, 32x32, 48x48, 64x64, 128x128
-                # Resize to closest standard size if needed
-                width, height = img.size
-                ico_sizes = [16, 32, 48, 64, 128, 256]
-                
-                # Find closest standard size
-                closest_size = min(ico_sizes, key=lambda x: abs(x - max(width, height)))
-                
-                # Resize if needed to maintain aspect ratio
-                if width != closest_size or height != closest_size:
-                    # Calculate new dimensions while preserving aspect ratio
-                    if width > height:
-                        new_width = closest_size
-                        new_height = int(height * closest_size / width)
-                    else:
-                        new_height = closest_size
-                        new_width = int(width * closest_size / height)
+            with metrics.stage('encode'):
+                if output_format in ('JPG', 'JPEG'):
+                    img.save(dest_path, format='JPEG', quality=quality)
+                elif output_format == 'PNG':
+                    img.save(dest_path, format='PNG', compress_level=int(10 - quality/10))
+                elif output_format == 'WEBP':
+                    img.save(dest_path, format='WEBP', quality=quality)
+                elif output_format == 'ICO':
+                    # For ICO format, we need to ensure it's in RGBA mode
+                    if img.mode != 'RGBA':
+                        img = img.convert('RGBA')
                     
-                    img = img.resize((new_width, new_height), Image.LANCZOS)
-                
-                # Try different approaches to save as ICO
-                try:
-                    # Approach 1: Simple save
-                    img.save(dest_path, format='ICO')
-                except Exception:
+                    # Ensure image size is appropriate for ICO format
+                    # ICO works best with standard sizes: 16x16, 32x32, 48x48, 64x64, 128x128
+                    # Resize to closest standard size if needed
+                    width, height = img.size
+                    ico_sizes = [16, 32, 48, 64, 128, 256]
+                    
+                    # Find closest standard size
+                    closest_size = min(ico_sizes, key=lambda x: abs(x - max(width, height)))
+                    
+                    # Resize if needed to maintain aspect ratio
+                    if width != closest_size or height != closest_size:
+                        # Calculate new dimensions while preserving aspect ratio
+                        if width > height:
+                            new_width = closest_size
+                            new_height = int(height * closest_size / width)
+                        else:
+                            new_height = closest_size
+                            new_width = int(width * closest_size / height)
+                        
+                        img = img.resize((new_width, new_height), Image.LANCZOS)
+                    
+                    # Try different approaches to save as ICO
                     try:
-                        # Approach 2: With sizes parameter
-                        img.save(dest_path, format='ICO', sizes=[(img.width, img.height)])
+                        # Approach 1: Simple save
+                        img.save(dest_path, format='ICO')
                     except Exception:
-                        # Approach 3: Save as PNG then manually rename
-                        png_path = dest_path.replace('.ico', '.png')
-                        img.save(png_path, format='PNG')
-                        if os.path.exists(png_path):
-                            os.rename(png_path, dest_path)
-            else:
-                img.save(dest_path)
+                        try:
+                            # Approach 2: With sizes parameter
+                            img.save(dest_path, format='ICO', sizes=[(img.width, img.height)])
+                        except Exception:
+                            # Approach 3: Save as PNG then manually rename
+                            png_path = dest_path.replace('.ico', '.png')
+                            img.save(png_path, format='PNG')
+                            if os.path.exists(png_path):
+                                os.rename(png_path, dest_path)
+                else:
+                    img.save(dest_path)
             
             return dest_path
             
@@ -0,0 +1,347 @@
+import os
+import json
+import bisect
+import time
+import threading
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages timed inside a conversion. Queue wait is derived by the pool and
+# history writes are timed per batch, not per conversion.
+STAGES = ('queue_wait', 'fingerprint', 'cache', 'decode', 'resize', 'crop', 'enhance', 'encode', 'total')
+
+OUTCOME_CONVERTED = 'converted'
+OUTCOME_CACHE_HIT = 'cache_hit'
+OUTCOME_DUPLICATE = 'duplicate'
+OUTCOME_ERROR = 'error'
+
+DEFAULT_EXPORT_INTERVAL = 15.0  # seconds between text file writes
+
+
+class _TimingState(threading.local):
+    timings = None  # Per-thread dict of stage -> seconds while timing is on
+
+
+_local = _TimingState()
+_no_stage = nullcontext()
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class _Stage:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings: Dict[str, float], name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def stage(name: str):
+    """Context manager timing one stage of the conversion running on this thread.
+
+    Does nothing unless timing was started on the thread, so the hot path
+    costs one attribute lookup when metrics are off.
+    """
+    timings = _local.timings
+    if timings is None:
+        return _no_stage
+    return _Stage(timings, name)
+
+
+def start_timing() -> Dict[str, float]:
+    """Collect stage() timings on this thread into the returned dict"""
+    _local.timings = {}
+    return _local.timings
+
+
+def stop_timing():
+    _local.timings = None
+
+
+def metrics_config(db) -> Optional[Tuple[int, str]]:
+    """(http_port, textfile_path) from the app settings, or None when metrics are off.
+
+    A port of 0 or an empty path means that export is not used; the stats
+    are still collected for stats().
+    """
+    if db.get_setting('metrics_enabled', '0') != '1':
+        return None
+    port = int(db.get_setting('metrics_port', 0) or 0)
+    return port, db.get_setting('metrics_textfile', '') or ''
+
+
+def get_metrics() -> 'ConversionMetrics':
+    """Shared metrics registry for this process"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = ConversionMetrics()
+        return _metrics
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by interpolating within the bucket that holds it"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(estimate, self.max)
+            seen += bucket_count
+        return self.max
+
+
+class ConversionMetrics:
+    """Per-profile stage timing histograms and byte counters for finished conversions.
+
+    The conversion pool calls record() with each result; stage timings are
+    measured on the worker that ran the conversion and travel back in the
+    result's timings, so conversions in worker processes are counted too.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (profile_id, stage) -> Histogram
+        self.counters = {}  # (profile_id, name) -> int
+        self.db_write = Histogram()
+        self.db_rows = 0
+        self.started_at = time.time()
+
+    def record(self, result: Dict[str, Any], queue_wait: Optional[float] = None):
+        profile_id = result['profile_id']
+        timings = result.get('timings') or {}
+
+        if result.get('error'):
+            outcome = OUTCOME_ERROR
+        elif result.get('cache_hit'):
+            outcome = OUTCOME_CACHE_HIT
+        elif result.get('duplicate_of'):
+            outcome = OUTCOME_DUPLICATE
+        else:
+            outcome = OUTCOME_CONVERTED
+
+        bytes_in = bytes_out = 0
+        if outcome == OUTCOME_CONVERTED:
+            try:
+                bytes_in = os.path.getsize(result['source_path'])
+                bytes_out = os.path.getsize(result['destination_path'])
+            except OSError:
+                pass
+
+        with self.lock:
+            for name, seconds in timings.items():
+                if name in STAGES:
+                    self.observe(profile_id, name, seconds)
+            if queue_wait is not None:
+                self.observe(profile_id, 'queue_wait', queue_wait)
+            self.add(profile_id, f"conversions_{outcome}", 1)
+            self.add(profile_id, 'bytes_read', bytes_in)
+            self.add(profile_id, 'bytes_written', bytes_out)
+
+    def record_db_write(self, seconds: float, rows: int):
+        with self.lock:
+            self.db_write.observe(seconds)
+            self.db_rows += rows
+
+    def observe(self, profile_id, name: str, seconds: float):
+        histogram = self.histograms.get((profile_id, name))
+        if histogram is None:
+            histogram = self.histograms[(profile_id, name)] = Histogram()
+        histogram.observe(seconds)
+
+    def add(self, profile_id, name: str, value: int):
+        self.counters[(profile_id, name)] = self.counters.get((profile_id, name), 0) + value
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of everything recorded so far, with estimated percentiles in milliseconds"""
+        with self.lock:
+            profiles = {}
+            for (profile_id, name), histogram in sorted(self.histograms.items(), key=str):
+                profile = profiles.setdefault(profile_id, {'stages': {}, 'counters': {}})
+                profile['stages'][name] = histogram_stats(histogram)
+            for (profile_id, name), value in sorted(self.counters.items(), key=str):
+                profile = profiles.setdefault(profile_id, {'stages': {}, 'counters': {}})
+                profile['counters'][name] = value
+            return {
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'profiles': profiles,
+                'db_write': dict(histogram_stats(self.db_write), rows=self.db_rows),
+            }
+
+    def prometheus_text(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP tbice_stage_seconds Time spent in each conversion stage.",
+            "# TYPE tbice_stage_seconds histogram",
+        ]
+        with self.lock:
+            for (profile_id, name), histogram in sorted(self.histograms.items(), key=str):
+                labels = f'profile="{profile_id}",stage="{name}"'
+                lines.extend(histogram_lines('tbice_stage_seconds', labels, histogram))
+
+            lines.append("# HELP tbice_conversions_total Finished conversions by outcome.")
+            lines.append("# TYPE tbice_conversions_total counter")
+            byte_lines = []
+            for (profile_id, name), value in sorted(self.counters.items(), key=str):
+                if name.startswith('conversions_'):
+                    outcome = name[len('conversions_'):]
+                    lines.append(f'tbice_conversions_total{{profile="{profile_id}",outcome="{outcome}"}} {value}')
+                else:
+                    byte_lines.append(f'tbice_{name}_total{{profile="{profile_id}"}} {value}')
+
+            for name, help_text in (('bytes_read', "Source bytes of converted files."),
+                                    ('bytes_written', "Output bytes written by conversions.")):
+                lines.append(f"# HELP tbice_{name}_total {help_text}")
+                lines.append(f"# TYPE tbice_{name}_total counter")
+                lines.extend(line for line in byte_lines if line.startswith(f"tbice_{name}_total"))
+
+            lines.append("# HELP tbice_db_write_seconds Time spent committing history batches.")
+            lines.append("# TYPE tbice_db_write_seconds histogram")
+            lines.extend(histogram_lines('tbice_db_write_seconds', '', self.db_write))
+            lines.append("# HELP tbice_db_rows_written_total History rows committed.")
+            lines.append("# TYPE tbice_db_rows_written_total counter")
+            lines.append(f"tbice_db_rows_written_total {self.db_rows}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Write prometheus_text() atomically, for node_exporter's textfile collector"""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+
+def histogram_stats(histogram: Histogram) -> Dict[str, Any]:
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'count': histogram.count,
+        'mean_ms': ms(histogram.sum / histogram.count) if histogram.count else None,
+        'p50_ms': ms(histogram.quantile(0.5)),
+        'p90_ms': ms(histogram.quantile(0.9)),
+        'p99_ms': ms(histogram.quantile(0.99)),
+    }
+
+
+def histogram_lines(name: str, labels: str, histogram: Histogram):
+    separator = ',' if labels else ''
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{{labels}{separator}le="+Inf"}} {histogram.count}'
+    suffix = f"{{{labels}}}" if labels else ''
+    yield f"{name}_sum{suffix} {histogram.sum}"
+    yield f"{name}_count{suffix} {histogram.count}"
+
+
+class MetricsExporter:
+    """Serves metrics on a local HTTP port and/or writes them to a text file periodically.
+
+    GET /metrics returns the Prometheus text format and GET /stats the
+    stats() snapshot as JSON. The server only listens on localhost.
+    """
+
+    def __init__(self, metrics: ConversionMetrics, port: int = 0, textfile: str = '',
+                 interval: float = DEFAULT_EXPORT_INTERVAL):
+        self.metrics = metrics
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self.server = None
+        self.stop_event = threading.Event()
+        self.writer_thread = None
+
+    def start(self):
+        if self.port:
+            try:
+                self.server = ThreadingHTTPServer(('127.0.0.1', self.port), self.make_handler())
+            except OSError as e:
+                print(f"Error starting metrics server on port {self.port}: {e}")
+            else:
+                self.server.daemon_threads = True
+                threading.Thread(target=self.server.serve_forever, name="tbice-metrics-http",
+                                 daemon=True).start()
+
+        if self.textfile:
+            self.writer_thread = threading.Thread(target=self.write_loop, name="tbice-metrics-file",
+                                                  daemon=True)
+            self.writer_thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.writer_thread is not None:
+            self.stop_event.set()
+            self.writer_thread.join()
+            self.writer_thread = None
+
+    def write_loop(self):
+        while True:
+            stopping = self.stop_event.wait(self.interval)
+            try:
+                self.metrics.write_textfile(self.textfile)
+            except OSError as e:
+                print(f"Error writing metrics to {self.textfile}: {e}")
+            if stopping:
+                return
+
+    def make_handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.prometheus_text().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/stats':
+                    body = json.dumps(metrics.stats(), indent=2).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would flood the console
+
+        return Handler
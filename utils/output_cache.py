@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from utils.pipeline import PIPELINE_FIELDS
+
+# Profile fields that determine the bytes of an output file. The filename
+# pattern and folders only decide where it goes, so profiles that differ
+# only in those share cache entries.
+OUTPUT_FIELDS = PIPELINE_FIELDS + ('quality', 'output_format')
+
+DEFAULT_CACHE_SIZE_MB = 1024
+EVICT_TO = 0.9  # fraction of the size limit left after an eviction pass
+
+_caches = {}  # cache_dir -> OutputCache, one per process
+_caches_lock = threading.Lock()
+
+
+def settings_hash(profile: Dict[str, Any]) -> str:
+    """Canonical hash of the profile settings that affect the output"""
+    settings = {field: profile.get(field) for field in OUTPUT_FIELDS}
+    if isinstance(settings['output_format'], str):
+        settings['output_format'] = settings['output_format'].upper()
+    canonical = json.dumps(settings, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def output_cache_config(db) -> Optional[Tuple[str, int]]:
+    """(cache_dir, max_bytes) from the app settings, or None when the cache is off"""
+    if db.get_setting('output_cache_enabled', '0') != '1':
+        return None
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(db.db_path)), 'output_cache')
+    cache_dir = db.get_setting('output_cache_dir', default_dir) or default_dir
+    size_mb = int(db.get_setting('output_cache_size_mb', DEFAULT_CACHE_SIZE_MB))
+    return cache_dir, size_mb * 1024 * 1024
+
+
+def get_output_cache(cache_dir: str, max_bytes: int) -> 'OutputCache':
+    """Shared cache instance for the calling process"""
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = _caches[cache_dir] = OutputCache(cache_dir, max_bytes)
+        cache.max_bytes = max_bytes
+        return cache
+
+
+class OutputCache:
+    """Content-addressed store of converted outputs, bounded in size with LRU eviction.
+
+    Entries are keyed by the source file's content hash plus the hash of
+    the settings that shape the output, so clearing a profile's history and
+    reprocessing, or a second profile with the same settings, copies the
+    earlier output instead of decoding and encoding again. Each entry is a
+    plain file whose mtime is bumped on every hit; when the cache grows
+    past max_bytes the least recently used entries are deleted. Several
+    processes can share one cache directory.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None  # Estimated size, measured on first store
+
+    @staticmethod
+    def make_key(content_hash: str, profile: Dict[str, Any]) -> str:
+        return hashlib.blake2b(
+            f"{content_hash}:{settings_hash(profile)}".encode('ascii'), digest_size=20
+        ).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        """Copy a cached output to dest_path, returning False on a miss"""
+        path = self.entry_path(key)
+        try:
+            os.utime(path)  # Mark as recently used
+            copy_atomic(path, dest_path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Error reading cached output for {dest_path}: {e}")
+            return False
+
+    def store(self, key: str, output_path: str):
+        """Add a freshly written output to the cache"""
+        path = self.entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            copy_atomic(output_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"Error caching output {output_path}: {e}")
+            return
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self.measure()
+            else:
+                self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self.total_bytes = self.evict(int(self.max_bytes * EVICT_TO))
+
+    def entries(self):
+        """Yield (mtime, size, path) for every cached file"""
+        try:
+            shards = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            with os.scandir(shard.path) as files:
+                for entry in files:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # Evicted by another process
+                    yield stat.st_mtime, stat.st_size, entry.path
+
+    def measure(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, target_bytes: int) -> int:
+        """Delete least recently used entries until the cache fits in target_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+
+def copy_atomic(source_path: str, dest_path: str):
+    """Copy via a temporary file so readers never see a partial file"""
+    temp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, dest_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
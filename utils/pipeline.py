@@ -0,0 +1,302 @@
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+from PIL import Image
+from utils.enhance import apply_enhancements
+from utils import metrics
+
+# Values of the decode_mode setting. When a JPEG is being scaled down a lot,
+# it can be decoded straight at a reduced size (DCT scaling) instead of
+# decoding every pixel and throwing most of them away in the resize.
+DECODE_FULL = 'Full'  # always decode at full resolution
+DECODE_QUALITY = 'Quality'  # reduced decode, output indistinguishable from Full
+DECODE_FAST = 'Fast'  # smallest reduced decode, slight softening possible
+DECODE_MODES = [DECODE_QUALITY, DECODE_FAST, DECODE_FULL]
+
+# Profile fields that affect the compiled pipeline; a cached pipeline is
+# reused only while these are unchanged
+PIPELINE_FIELDS = (
+    'resize_width', 'resize_height', 'decode_mode',
+    'crop_left', 'crop_top', 'crop_right', 'crop_bottom',
+    'brightness', 'contrast', 'sharpness', 'saturation'
+)
+
+
+class ResizeOp(NamedTuple):
+    """Resize by a percentage (scale) or to fixed dimensions (size)"""
+    scale: Optional[float] = None
+    size: Optional[Tuple[int, int]] = None
+
+    def target(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        if self.size:
+            return self.size
+        return int(size[0] * self.scale), int(size[1] * self.scale)
+
+    def then(self, other: 'ResizeOp') -> 'ResizeOp':
+        """Merge with a following resize into a single one"""
+        if other.size:
+            return other
+        if self.size:
+            return ResizeOp(size=(int(self.size[0] * other.scale), int(self.size[1] * other.scale)))
+        return ResizeOp(scale=self.scale * other.scale)
+
+
+class CropOp(NamedTuple):
+    box: Tuple[int, int, int, int]
+
+
+class RegionResizeOp(NamedTuple):
+    """A resize followed by a crop, planned as one resize of just the cropped region.
+
+    The crop box is given in resized coordinates, as in the profile, and is
+    mapped back into source coordinates at run time.
+    """
+    resize: ResizeOp
+    box: Tuple[int, int, int, int]
+
+
+class BoxResizeOp(NamedTuple):
+    """Resize the box region of the image (in its own coordinates) to size"""
+    size: Tuple[int, int]
+    box: Tuple[float, float, float, float]
+
+
+class EnhanceOp(NamedTuple):
+    brightness: float
+    contrast: float
+    sharpness: float
+    saturation: float
+
+
+# Metrics stage each operation's time is counted under
+OP_STAGES = {
+    ResizeOp: 'resize',
+    RegionResizeOp: 'resize',
+    BoxResizeOp: 'resize',
+    CropOp: 'crop',
+    EnhanceOp: 'enhance',
+}
+
+
+def profile_operations(profile: Dict[str, Any]) -> List[NamedTuple]:
+    """List the profile's operations in the order the profile defines them"""
+    ops = []
+
+    resize_width = profile.get('resize_width', 0)
+    resize_height = profile.get('resize_height', 0)
+    if resize_width == -1:
+        # Percentage resize (percentage value stored in height field)
+        ops.append(ResizeOp(scale=resize_height / 100.0))
+    elif resize_width > 0 and resize_height > 0:
+        ops.append(ResizeOp(size=(resize_width, resize_height)))
+
+    box = (profile['crop_left'], profile['crop_top'], profile['crop_right'], profile['crop_bottom'])
+    if all(v > 0 for v in box):
+        ops.append(CropOp(box))
+
+    ops.append(EnhanceOp(
+        profile['brightness'], profile['contrast'], profile['sharpness'], profile['saturation']
+    ))
+    return ops
+
+
+def plan_operations(ops: List[NamedTuple]) -> List[NamedTuple]:
+    """Drop no-op steps, merge consecutive resizes and push crops ahead of resizes"""
+    planned = []
+    for op in ops:
+        if isinstance(op, ResizeOp) and op.scale == 1.0:
+            continue
+        if isinstance(op, EnhanceOp) and op == (1.0, 1.0, 1.0, 1.0):
+            continue
+
+        previous = planned[-1] if planned else None
+        if isinstance(op, ResizeOp) and isinstance(previous, ResizeOp):
+            planned[-1] = previous.then(op)
+        elif isinstance(op, CropOp) and isinstance(previous, ResizeOp):
+            planned[-1] = RegionResizeOp(previous, op.box)
+        else:
+            planned.append(op)
+    return planned
+
+
+class Pipeline:
+    """A profile compiled into an ordered list of image operations"""
+
+    def __init__(self, ops: List[NamedTuple], reducing_gap: Optional[float] = None):
+        self.ops = ops
+        self.reducing_gap = reducing_gap
+
+    def decode_size(self, source_size: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """Resolution the pipeline needs from a source of source_size, if it scales it down"""
+        if not self.ops:
+            return None
+        first = self.ops[0]
+        if isinstance(first, RegionResizeOp):
+            first = first.resize
+        if isinstance(first, ResizeOp):
+            return first.target(source_size)
+        return None
+
+    def run(self, img: Image.Image, source_size: Optional[Tuple[int, int]] = None,
+            start: int = 0) -> Image.Image:
+        """Apply the operations to img, from ops[start] onwards.
+
+        source_size is the full-resolution size of the source; it differs
+        from img.size when the image was decoded at a reduced scale.
+        """
+        source_size = source_size or img.size
+        for op in self.ops[start:]:
+            img = self.apply(op, img, source_size)
+            source_size = img.size
+        return img
+
+    def apply(self, op: NamedTuple, img: Image.Image, source_size: Tuple[int, int]) -> Image.Image:
+        with metrics.stage(OP_STAGES.get(type(op), 'resize')):
+            if isinstance(op, ResizeOp):
+                return self.resize(img, op.target(source_size))
+            if isinstance(op, RegionResizeOp):
+                return self.region_resize(img, op, source_size)
+            if isinstance(op, BoxResizeOp):
+                return self.resize(img, op.size, box=op.box)
+            if isinstance(op, CropOp):
+                return img.crop(op.box)
+            if isinstance(op, EnhanceOp):
+                return apply_enhancements(img, *op)
+            return img
+
+    def prefix_key(self, length: int) -> tuple:
+        """Identifies the image produced by the first length operations"""
+        return self.reducing_gap, tuple(self.ops[:length])
+
+    def resize(self, img: Image.Image, size: Tuple[int, int], box=None) -> Image.Image:
+        if self.reducing_gap:
+            return img.resize(size, Image.LANCZOS, box=box, reducing_gap=self.reducing_gap)
+        return img.resize(size, Image.LANCZOS, box=box)
+
+    def region_resize(self, img: Image.Image, op: RegionResizeOp, source_size) -> Image.Image:
+        resized_width, resized_height = op.resize.target(source_size)
+        left, top, right, bottom = op.box
+        if not (0 <= left < right <= resized_width and 0 <= top < bottom <= resized_height):
+            # Crops reaching outside the resized image are padded by crop(),
+            # which a region resize cannot do; keep the original order
+            return self.resize(img, (resized_width, resized_height)).crop(op.box)
+
+        scale_x = img.width / resized_width
+        scale_y = img.height / resized_height
+        box = (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+        return self.resize(img, (right - left, bottom - top), box=box)
+
+
+def run_shared_prefixes(pipelines: List[Pipeline], img: Image.Image,
+                        source_size: Tuple[int, int]) -> List[Tuple[Image.Image, Tuple[int, int], int]]:
+    """Run the operations several pipelines have in common on one decoded image.
+
+    Each distinct leading run of operations shared by two or more pipelines
+    is computed once. Returns, per pipeline, the image after its longest
+    shared prefix, the source size to continue with and the index of its
+    first remaining operation, ready for Pipeline.run(img, size, start).
+    """
+    counts = {}
+    for pipeline in pipelines:
+        for length in range(1, len(pipeline.ops) + 1):
+            key = pipeline.prefix_key(length)
+            counts[key] = counts.get(key, 0) + 1
+
+    computed = {}  # prefix key -> (image, source size)
+    results = []
+    for pipeline in pipelines:
+        current, current_size, done = img, source_size, 0
+        for length in range(1, len(pipeline.ops) + 1):
+            key = pipeline.prefix_key(length)
+            if counts[key] < 2:
+                break
+            if key not in computed:
+                stepped = pipeline.apply(pipeline.ops[length - 1], current, current_size)
+                computed[key] = (stepped, stepped.size)
+            current, current_size = computed[key]
+            done = length
+        results.append((current, current_size, done))
+    return results
+
+
+def output_geometry(pipeline: Pipeline, source_size: Tuple[int, int]):
+    """Reduce a pipeline's resizes and crops to one region of the source and an output size.
+
+    Returns (box, size, tail_ops): the output is the box region of the
+    source (in source pixels) resized to size, followed by the remaining
+    non-geometric operations. Returns None if the geometry cannot be
+    expressed this way, e.g. for crops reaching outside the image.
+    """
+    box = (0.0, 0.0, float(source_size[0]), float(source_size[1]))
+    size = source_size
+    tail_ops = []
+    for op in pipeline.ops:
+        if isinstance(op, EnhanceOp):
+            tail_ops.append(op)
+            continue
+        if tail_ops:
+            return None  # Geometry after an enhancement; keep the real order
+
+        if isinstance(op, ResizeOp):
+            size = op.target(size)
+            continue
+        if isinstance(op, RegionResizeOp):
+            size = op.resize.target(size)
+        left, top, right, bottom = op.box
+        if not (0 <= left < right <= size[0] and 0 <= top < bottom <= size[1]):
+            return None
+        scale_x = (box[2] - box[0]) / size[0]
+        scale_y = (box[3] - box[1]) / size[1]
+        box = (box[0] + left * scale_x, box[1] + top * scale_y,
+               box[0] + right * scale_x, box[1] + bottom * scale_y)
+        size = (right - left, bottom - top)
+
+    if size[0] <= 0 or size[1] <= 0:
+        return None
+    return box, size, tail_ops
+
+
+def preview_geometry(pipeline: Pipeline, source_size: Tuple[int, int], max_size: Tuple[int, int]):
+    """Like output_geometry, with the output size scaled down to fit max_size.
+
+    Rendering that from a reduced copy of the source gives a preview
+    without processing every source pixel.
+    """
+    geometry = output_geometry(pipeline, source_size)
+    if geometry is None:
+        return None
+    box, size, tail_ops = geometry
+    scale = min(1.0, max_size[0] / size[0], max_size[1] / size[1])
+    display_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+    return box, display_size, tail_ops
+
+
+def compile_pipeline(profile: Dict[str, Any]) -> Pipeline:
+    reducing_gap = 2.0 if profile.get('decode_mode') == DECODE_FAST else None
+    return Pipeline(plan_operations(profile_operations(profile)), reducing_gap=reducing_gap)
+
+
+_pipeline_cache = {}  # profile id -> (settings, Pipeline)
+
+
+def get_pipeline(profile: Dict[str, Any]) -> Pipeline:
+    """Return the compiled pipeline for a profile, compiling it on first use"""
+    profile_id = profile.get('id')
+    if profile_id is None:
+        # Unsaved profiles (editor previews) are cheap to compile and never reused
+        return compile_pipeline(profile)
+
+    settings = tuple(profile.get(field) for field in PIPELINE_FIELDS)
+    cached = _pipeline_cache.get(profile_id)
+    if cached and cached[0] == settings:
+        return cached[1]
+
+    pipeline = compile_pipeline(profile)
+    _pipeline_cache[profile_id] = (settings, pipeline)
+    return pipeline
+
+
+def invalidate_pipeline(profile_id: Optional[int] = None):
+    """Forget a profile's compiled pipeline (or all of them) after its settings change"""
+    if profile_id is None:
+        _pipeline_cache.clear()
+    else:
+        _pipeline_cache.pop(profile_id, None)
@@ -0,0 +1,186 @@
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from typing import Any, Callable, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_MIN_SECONDS = 10
+DEFAULT_MIN_MEMORY_MB = 512
+MAX_CAPTURES = 100  # oldest captures are deleted beyond this
+TRACE_FRAMES = 10
+TOP_ALLOCATIONS = 25
+TOP_FUNCTIONS = 40
+
+_tracing_lock = threading.Lock()
+_traced_steps = 0  # profiled steps running in this process; guarded by _tracing_lock
+# From Python 3.12 cProfile uses sys.monitoring, which allows only one active
+# profiler per process; before that each thread profiles on its own
+_profiler_lock = threading.Lock() if sys.version_info >= (3, 12) else None
+
+
+def profiling_config(db) -> Optional[Tuple[str, float, int]]:
+    """(capture_dir, min_seconds, min_bytes) from the app settings, or None when profiling is off"""
+    if db.get_setting('profiling_enabled', '0') != '1':
+        return None
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(db.db_path)), 'profiling')
+    capture_dir = db.get_setting('profiling_dir', default_dir) or default_dir
+    min_seconds = float(db.get_setting('profiling_min_seconds', DEFAULT_MIN_SECONDS))
+    min_mb = int(db.get_setting('profiling_min_memory_mb', DEFAULT_MIN_MEMORY_MB))
+    return capture_dir, min_seconds, min_mb * 1024 * 1024
+
+
+def stop_tracing():
+    """Stop tracemalloc in this process once profiling is turned off; it slows every allocation"""
+    with _tracing_lock:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes, or 0 where unavailable"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def profiled(config: Tuple[str, float, int], profile_id, source_path: str,
+             step: Callable[..., Any], *args) -> Any:
+    """Run a conversion step under cProfile and tracemalloc, keeping the capture only if it was slow.
+
+    A capture is written when the step takes at least min_seconds, or
+    when memory grew by at least min_bytes. Pillow allocates pixel data
+    outside the Python allocator, so memory growth is the larger of the
+    traced Python allocations and the rise in the process's peak RSS.
+    With several conversions running at once both figures include the
+    others' allocations, so treat them as an upper bound. From Python
+    3.12 a step that starts while another is being profiled runs
+    unprofiled.
+    """
+    if _profiler_lock is None:
+        return profile_step(config, profile_id, source_path, step, *args)
+    if not _profiler_lock.acquire(blocking=False):
+        return step(*args)
+    try:
+        return profile_step(config, profile_id, source_path, step, *args)
+    finally:
+        _profiler_lock.release()
+
+
+def profile_step(config: Tuple[str, float, int], profile_id, source_path: str,
+                 step: Callable[..., Any], *args) -> Any:
+    global _traced_steps
+    capture_dir, min_seconds, min_bytes = config
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool (e.g. a debugger) is already active
+        return step(*args)
+
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        if _traced_steps == 0 and hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+            # The peak is process-wide; while other steps run it also covers
+            # their allocations, so it is only reset when none are
+            tracemalloc.reset_peak()
+        _traced_steps += 1
+        traced_before = tracemalloc.get_traced_memory()[0]
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    try:
+        return step(*args)
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start
+        with _tracing_lock:
+            _traced_steps -= 1
+            # Without reset_peak the peak may predate the step, so use what it still holds
+            traced_peak = tracemalloc.get_traced_memory()[1 if hasattr(tracemalloc, 'reset_peak') else 0]
+        memory_growth = max(traced_peak - traced_before, peak_rss() - rss_before, 0)
+
+        if duration >= min_seconds or memory_growth >= min_bytes:
+            try:
+                write_capture(capture_dir, profile_id, source_path, profiler, duration,
+                              memory_growth, tracemalloc.take_snapshot())
+            except Exception as e:
+                print(f"Error saving profile of {source_path}: {e}")
+
+
+def write_capture(capture_dir: str, profile_id, source_path: str, profiler: cProfile.Profile,
+                  duration: float, memory_growth: int, snapshot: tracemalloc.Snapshot):
+    """Save a .prof file for pstats/snakeviz, a readable summary and the details as JSON"""
+    os.makedirs(capture_dir, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', os.path.basename(source_path))[:80]
+    profile_label = '-'.join(str(pid) for pid in profile_id) if isinstance(profile_id, list) else profile_id
+    now = time.time()
+    stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+    base = os.path.join(
+        capture_dir, f"{stamp}_p{profile_label}_{name}_{os.getpid()}-{threading.get_ident()}"
+    )
+
+    profiler.dump_stats(f"{base}.prof")
+    with open(f"{base}.txt", 'w') as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+
+    details = {
+        'source_path': source_path,
+        'profile_id': profile_id,
+        'captured_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'duration_s': round(duration, 3),
+        'memory_growth_mb': round(memory_growth / (1024 * 1024), 1),
+        'peak_rss_mb': round(peak_rss() / (1024 * 1024), 1),
+        'source': describe_source(source_path),
+        'top_allocations': [
+            {'location': str(stat.traceback[0]), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+        ],
+    }
+    with open(f"{base}.json", 'w') as f:
+        json.dump(details, f, indent=2)
+
+    prune_captures(capture_dir)
+
+
+def describe_source(source_path: str) -> dict:
+    """File size and image header of the source, which usually explain pathological inputs"""
+    details = {}
+    try:
+        details['file_size'] = os.path.getsize(source_path)
+        with Image.open(source_path) as img:
+            details.update(format=img.format, mode=img.mode, size=list(img.size),
+                           frames=getattr(img, 'n_frames', 1))
+    except Exception as e:
+        details['error'] = str(e)
+    return details
+
+
+def prune_captures(capture_dir: str, keep: int = MAX_CAPTURES):
+    """Delete the oldest captures so a misconfigured threshold cannot fill the disk"""
+    captures = {}
+    with os.scandir(capture_dir) as entries:
+        for entry in entries:
+            base, ext = os.path.splitext(entry.path)
+            if ext in ('.prof', '.txt', '.json'):
+                captures.setdefault(base, []).append(entry.path)
+    for base in sorted(captures)[:-keep]:
+        for path in captures[base]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
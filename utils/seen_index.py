@@ -0,0 +1,74 @@
+import math
+import hashlib
+
+from database.db_manager import Database
+
+MIN_CAPACITY = 100000
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(int(capacity), 1)
+        self.num_bits = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Double hashing: derive every probe from one 128-bit digest
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class SeenFileIndex:
+    """Compact index of (profile_id, source_path) pairs that have been processed.
+
+    A Bloom filter answers most "is this file new?" questions in memory; only
+    positive hits are confirmed with an indexed lookup in processed_files, so
+    false positives and history cleared from the database are both handled
+    without rebuilding. The filter is grown (rebuilt from the database) only
+    once it holds more keys than it was sized for.
+    """
+
+    def __init__(self, error_rate: float = 0.01):
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(MIN_CAPACITY, error_rate)
+
+    @staticmethod
+    def make_key(profile_id: int, source_path: str) -> str:
+        return f"{profile_id}\0{source_path}"
+
+    def build(self, db: Database):
+        """Fill the filter from processed_files, streaming rows rather than loading them"""
+        count = db.get_processed_files_count()
+        bloom = BloomFilter(max(count * 2, MIN_CAPACITY), self.error_rate)
+        for profile_id, source_path in db.iter_processed_files():
+            bloom.add(self.make_key(profile_id, source_path))
+        self.bloom = bloom
+
+    def add(self, profile_id: int, source_path: str, db: Database = None):
+        self.bloom.add(self.make_key(profile_id, source_path))
+        if db is not None and self.bloom.count > self.bloom.capacity:
+            self.build(db)
+            self.bloom.add(self.make_key(profile_id, source_path))
+
+    def contains(self, db: Database, profile_id: int, source_path: str) -> bool:
+        if self.make_key(profile_id, source_path) not in self.bloom:
+            return False
+        return db.is_processed(profile_id, source_path)
@@ -0,0 +1,241 @@
+import math
+from typing import Callable, Optional, Tuple
+
+from PIL import Image, TiffImagePlugin
+
+from utils import metrics
+from utils.enhance import apply_enhancements, brightness_contrast_lut
+from utils.pipeline import EnhanceOp, Pipeline, output_geometry
+
+DEFAULT_JOB_MEMORY_MB = 1024
+LANCZOS_SUPPORT = 3  # Lanczos filter radius, in pixels of the smaller side of a resize
+BAND_COPIES = 3  # copies of a band alive at once: as read, converted and resampled
+MIN_BAND_ROWS = 16
+
+# TIFF tags
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_PLANAR_CONFIGURATION = 284
+TAG_TILE_WIDTH = 322
+
+
+def job_memory_limit(db) -> Optional[int]:
+    """Memory limit per conversion in bytes from the app settings, or None for no limit"""
+    memory_mb = int(db.get_setting('job_memory_mb', DEFAULT_JOB_MEMORY_MB) or 0)
+    return memory_mb * 1024 * 1024 if memory_mb > 0 else None
+
+
+def bytes_per_pixel(mode: str) -> int:
+    """Bytes Pillow uses per pixel in memory: multi-band modes are stored as 32-bit pixels"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def decoded_bytes(mode: str, size: Tuple[int, int]) -> int:
+    """Memory needed to hold an image of this mode and size decoded"""
+    return size[0] * size[1] * bytes_per_pixel(mode)
+
+
+class StripReader:
+    """Reads bands of rows from an uncompressed, strip-organised TIFF.
+
+    Only the requested rows are read from the file, so the image is never
+    decoded whole. This is how most scanners write large TIFFs; compressed
+    TIFFs are decoded by libtiff as a single unit and cannot be read this way.
+    """
+
+    def __init__(self, source_path: str, img: Image.Image):
+        tags = img.tag_v2
+        self.source_path = source_path
+        self.mode = img.mode
+        self.size = img.size
+        self.rawmode = img.tile[0][3][0]  # Tile entries are plain tuples before Pillow 11
+        self.offsets = tags[TAG_STRIP_OFFSETS]
+        self.byte_counts = tags[TAG_STRIP_BYTE_COUNTS]
+        self.rows_per_strip = min(tags.get(TAG_ROWS_PER_STRIP, img.height), img.height)
+
+    @staticmethod
+    def supports(img: Image.Image) -> bool:
+        if img.format != 'TIFF' or img.mode in ('P', 'PA') or not img.tile:
+            return False
+        tags = img.tag_v2
+        if (tags.get(TAG_COMPRESSION, 1) != 1 or TAG_TILE_WIDTH in tags
+                or tags.get(TAG_PLANAR_CONFIGURATION, 1) != 1):
+            return False
+        for tile in img.tile:
+            # (rawmode, stride, orientation); anything but packed top-down rows is left to Pillow
+            codec_name, args = tile[0], tile[3]
+            if codec_name != 'raw' or tuple(args[1:]) not in ((), (0,), (0, 1)):
+                return False
+
+        offsets = tags.get(TAG_STRIP_OFFSETS)
+        byte_counts = tags.get(TAG_STRIP_BYTE_COUNTS)
+        rows_per_strip = min(tags.get(TAG_ROWS_PER_STRIP, img.height), img.height)
+        strips = math.ceil(img.height / rows_per_strip) if rows_per_strip else 0
+        return bool(strips) and len(offsets or ()) == strips and len(byte_counts or ()) == strips
+
+    def read(self, top: int, bottom: int) -> Image.Image:
+        """Decode rows top to bottom (exclusive) as an image of the file's mode"""
+        width, height = self.size
+        chunks = []
+        with open(self.source_path, 'rb') as f:
+            for strip in range(top // self.rows_per_strip, (bottom - 1) // self.rows_per_strip + 1):
+                strip_top = strip * self.rows_per_strip
+                strip_rows = min(self.rows_per_strip, height - strip_top)
+                row_bytes = self.byte_counts[strip] // strip_rows
+                first, last = max(top, strip_top), min(bottom, strip_top + strip_rows)
+
+                f.seek(self.offsets[strip] + (first - strip_top) * row_bytes)
+                length = (last - first) * row_bytes
+                chunk = f.read(length)
+                if len(chunk) != length:
+                    raise OSError(f"{self.source_path} is truncated")
+                chunks.append(chunk)
+        return Image.frombytes(self.mode, (width, bottom - top), b''.join(chunks), 'raw', self.rawmode)
+
+
+def open_large_tiff(source_path: str) -> Optional[Image.Image]:
+    """Open a TIFF over Pillow's decompression bomb limit, if it can be read in strips.
+
+    The limit guards against decoding huge images whole; a StripReader
+    never does, so it is safe to bypass for those files only.
+    """
+    try:
+        img = TiffImagePlugin.TiffImageFile(source_path)
+    except Exception:
+        return None
+    if not StripReader.supports(img):
+        img.close()
+        return None
+    return img
+
+
+def process_large(pipeline: Pipeline, img: Image.Image, source_path: str,
+                  source_size: Tuple[int, int], memory_limit: int) -> Optional[Image.Image]:
+    """Run a pipeline over an image too large to copy freely, one band of rows at a time.
+
+    Uncompressed strip TIFFs are read from the file a band at a time.
+    Other images are decoded once, and mode conversion, crop, resize and
+    enhancements then work on bands instead of full-size copies. Pillow
+    encoders need the whole output image, so that is built in memory.
+    Returns None if the pipeline's geometry cannot be applied in bands,
+    and raises ValueError if the decoded source (when it cannot be read
+    in strips) and the output leave no room for bands within memory_limit.
+
+    img is the opened, not yet loaded image (after any JPEG draft), and
+    source_size the full-resolution size the pipeline is planned for.
+    """
+    geometry = output_geometry(pipeline, source_size)
+    if geometry is None:
+        return None
+    box, output_size, tail_ops = geometry
+
+    # The box is in full-resolution pixels; a draft decode may be smaller
+    scale_x = img.width / source_size[0]
+    scale_y = img.height / source_size[1]
+    box = (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)
+
+    if StripReader.supports(img):
+        read_band = StripReader(source_path, img).read
+        reserved = 0
+    else:
+        def read_band(top, bottom):
+            return img.crop((0, top, img.width, bottom))
+        reserved = decoded_bytes(img.mode, img.size)
+
+    output_mode = 'RGBA' if img.mode == 'RGBA' else 'RGB'
+    reserved += decoded_bytes(output_mode, output_size)
+    needed = reserved + band_bytes(max(img.width, output_size[0]), MIN_BAND_ROWS)
+    if needed > memory_limit:
+        raise ValueError(f"{img.width}x{img.height} image needs about {needed // (1024 * 1024)} MB, "
+                         f"over the {memory_limit // (1024 * 1024)} MB memory limit per job")
+
+    output = Image.new(output_mode, output_size)
+    render_bands(output, read_band, img.size, box, band_rows(img.width, memory_limit, reserved))
+
+    for op in tail_ops:
+        if isinstance(op, EnhanceOp):
+            enhance_in_bands(output, op, band_rows(output.width, memory_limit, reserved))
+    return output
+
+
+def band_rows(width: int, memory_limit: int, reserved: int) -> int:
+    """Rows per band so the band's working copies fit in what the limit leaves over"""
+    return max(MIN_BAND_ROWS, (memory_limit - reserved) // band_bytes(width, 1))
+
+
+def band_bytes(width: int, rows: int) -> int:
+    """Memory for the working copies of one band"""
+    return BAND_COPIES * 4 * width * rows
+
+
+def render_bands(output: Image.Image, read_band: Callable[[int, int], Image.Image],
+                 source_size: Tuple[int, int], box, source_rows: int):
+    """Fill output with the box region of the source, resized to fit, a band at a time.
+
+    Each band of output rows is resampled from the source rows under it
+    plus a margin covering the filter's reach, with the band's position
+    passed to resize() as a box, so the bands join without seams.
+    """
+    out_width, out_height = output.size
+    box_width, box_height = box[2] - box[0], box[3] - box[1]
+    resampling = (box_width != out_width or box_height != out_height
+                  or any(value != int(value) for value in box))
+    scale_y = box_height / out_height
+    margin = math.ceil(LANCZOS_SUPPORT * max(scale_y, 1.0)) + 1 if resampling else 0
+    out_rows = max(1, int((source_rows - 2 * margin) / scale_y))
+
+    for out_top in range(0, out_height, out_rows):
+        out_bottom = min(out_top + out_rows, out_height)
+        top = box[1] + out_top * scale_y
+        bottom = box[1] + out_bottom * scale_y
+        read_top = max(0, math.floor(top) - margin)
+        read_bottom = min(source_size[1], math.ceil(bottom) + margin)
+
+        with metrics.stage('decode'):
+            band = read_band(read_top, read_bottom)
+            if band.mode != output.mode:
+                band = band.convert(output.mode)
+
+        if resampling:
+            with metrics.stage('resize'):
+                band = band.resize((out_width, out_bottom - out_top), Image.LANCZOS,
+                                   box=(box[0], top - read_top, box[2], bottom - read_top))
+        else:
+            with metrics.stage('crop'):
+                band = band.crop((int(box[0]), int(top) - read_top, int(box[2]), int(bottom) - read_top))
+        output.paste(band, (0, out_top))
+
+
+def enhance_in_bands(img: Image.Image, op: EnhanceOp, rows: int):
+    """Apply an EnhanceOp to img in place, a band of rows at a time.
+
+    Contrast uses the mean grey level of the whole image, so its lookup
+    table is built once up front. Sharpening looks one pixel past each
+    band; every band is read before the band above it is written back, so
+    it only ever sees unsharpened neighbours.
+    """
+    brightness, contrast, sharpness, saturation = op
+    lut = None
+    if brightness != 1.0 or contrast != 1.0:
+        lut = brightness_contrast_lut(img, brightness, contrast)
+    overlap = 1 if sharpness != 1.0 else 0
+
+    pending = None
+    for top in range(0, img.height, rows):
+        bottom = min(top + rows, img.height)
+        band_top, band_bottom = max(0, top - overlap), min(img.height, bottom + overlap)
+        band = img.crop((0, band_top, img.width, band_bottom))
+        if pending:
+            img.paste(*pending)
+
+        with metrics.stage('enhance'):
+            band = apply_enhancements(band, *op, point_lut=lut)
+        pending = (band.crop((0, top - band_top, img.width, bottom - band_top)), (0, top))
+    if pending:
+        img.paste(*pending)
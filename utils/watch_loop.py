@@ -0,0 +1,380 @@
+import os
+import time
+import threading
+from typing import Callable, List, Optional
+from database.db_manager import Database
+from utils import inotify
+from utils.seen_index import SeenFileIndex
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.ico')
+
+# Values of the watch_mode setting
+WATCH_MODE_AUTO = 'Auto'  # inotify where available, polling elsewhere
+WATCH_MODE_POLLING = 'Polling'
+WATCH_MODES = [WATCH_MODE_AUTO, WATCH_MODE_POLLING]
+
+WATCH_EVENTS = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR
+
+# A file found by scanning is only converted once its size and modification
+# time have stayed the same for this many checks, one STABILITY_INTERVAL apart
+DEFAULT_STABILITY_CHECKS = 2
+STABILITY_INTERVAL = 1.0
+
+# Folder timestamps newer than this are not trusted to skip a polling rescan,
+# since filesystems with coarse mtimes can hide a change made in the same tick
+FOLDER_MTIME_GRACE_NS = 2000000000
+
+class WatchLoop:
+    """Finds new image files in the source folders of active profiles.
+
+    This is the Qt-free core of FolderWatcher, also used directly by the
+    headless runner. run() blocks until stop() is called and reports each
+    new file by calling on_file(file_path, profile_ids) from the thread
+    running the loop. Profiles sharing a source folder are handled
+    together: the folder is listed once and a new file is reported once
+    with every profile that still needs it, so it can be decoded once.
+    """
+    
+    def __init__(self, db: Database, on_file: Optional[Callable[[str, List[int]], None]] = None,
+                 profile_names=None):
+        self.db = db
+        self.on_file = on_file
+        self.on_pass = None  # Called from the loop's thread before each pass, e.g. to apply a reload
+        # Restrict watching to these profile names; None watches every active profile
+        self.profile_names = set(profile_names) if profile_names else None
+        self.db_path = db.db_path  # Store path to create thread-safe connection later
+        self.thread_db = None  # This will hold our thread's database connection
+        self.running = False
+        self.profiles = {}
+        self.seen_index = SeenFileIndex()  # Processed files, kept across monitoring restarts
+        self.seen_index_built = False
+        self.in_flight = set()  # (file_path, profile_id) emitted but not yet recorded
+        # (file_path, profile_id) that failed -> the file's (size, mtime_ns) then; retried once it changes
+        self.failed = {}
+        self.state_lock = threading.Lock()
+        self.rescan_requested = False
+        self.folder_mtimes = {}  # (folder, profile_ids) -> mtime_ns at the last polling scan
+        self.pending_files = {}  # file_path -> [size, mtime_ns, stable_checks, profile_ids]
+        self.last_pending_check = 0.0
+        self.watch_mode = WATCH_MODE_AUTO
+        self.stability_checks = DEFAULT_STABILITY_CHECKS
+        self.reload_profiles()
+    
+    def reload_profiles(self):
+        profiles = self.db.get_profiles()
+        self.profiles = {
+            p['id']: p for p in profiles
+            if p['is_active'] and (self.profile_names is None or p['name'] in self.profile_names)
+        }
+        self.watch_mode = self.db.get_setting('watch_mode', WATCH_MODE_AUTO)
+        self.stability_checks = int(self.db.get_setting('stability_checks', DEFAULT_STABILITY_CHECKS))
+    
+    def profiles_by_folder(self):
+        """Group active profile ids by source folder"""
+        folders = {}
+        for profile_id, profile in list(self.profiles.items()):
+            folders.setdefault(profile['source_folder'], []).append(profile_id)
+        return folders
+        
+    def create_thread_db(self):
+        """Create a thread-specific database connection"""
+        if self.thread_db is not None:
+            # Close existing connection if there is one
+            try:
+                self.thread_db.close()
+            except:
+                pass
+        
+        # Create a new connection for this thread
+        self.thread_db = Database(self.db_path)
+    
+    def load_processed_files(self):
+        """Build the seen-file index from the database - ONLY CALL FROM WATCHER THREAD"""
+        # The index is only built once; afterwards it is updated as files are
+        # emitted, and lookups that hit it are confirmed against the database,
+        # so profile edits and cleared history need no reload
+        if self.seen_index_built:
+            return
+        
+        try:
+            self.seen_index.build(self.thread_db)
+            self.seen_index_built = True
+        except Exception as e:
+            print(f"Error building processed files index: {e}")
+    
+    def request_rescan(self):
+        """Ask the watcher to rescan every source folder, e.g. after history was cleared"""
+        with self.state_lock:
+            self.failed.clear()  # Failed files are retried too
+        self.rescan_requested = True
+    
+    def mark_done(self, file_path, profile_id, success=True):
+        """Report that an emitted file has been recorded in the database or has failed"""
+        key = (file_path, profile_id)
+        stat = None if success else self.stat_file(file_path)
+        with self.state_lock:
+            self.in_flight.discard(key)
+            if not success:
+                self.failed[key] = stat
+    
+    def is_known(self, file_path, profile_id):
+        """True if the file is converted, being converted, or failed and not changed since"""
+        key = (file_path, profile_id)
+        with self.state_lock:
+            if key in self.in_flight or key in self.failed:
+                return True
+        try:
+            return self.seen_index.contains(self.thread_db, profile_id, file_path)
+        except Exception as e:
+            print(f"Error checking processed files: {e}")
+            return True
+    
+    def run(self):
+        self.running = True
+        self.pending_files.clear()
+        
+        # Create a thread-specific database connection
+        self.create_thread_db()
+        
+        # Load processed files from database when starting
+        self.load_processed_files()
+        
+        notifier = None
+        if self.watch_mode != WATCH_MODE_POLLING and inotify.is_available():
+            try:
+                notifier = inotify.Inotify()
+            except OSError as e:
+                print(f"inotify unavailable, falling back to polling: {e}")
+        
+        try:
+            if notifier:
+                try:
+                    self.run_inotify(notifier)
+                finally:
+                    notifier.close()
+            else:
+                self.run_polling()
+        finally:
+            # Close the thread-specific database connection from its own thread
+            self.thread_db.close()
+            self.thread_db = None
+    
+    def run_polling(self):
+        """Fallback loop: check every active source folder once per second"""
+        while self.running:
+            if self.on_pass:
+                self.on_pass()
+            if self.rescan_requested:
+                self.rescan_requested = False
+                self.folder_mtimes.clear()
+            
+            for folder, profile_ids in self.profiles_by_folder().items():
+                if not self.running:
+                    break
+                if self.folder_changed(folder, profile_ids):
+                    self.scan_folder(folder, profile_ids)
+            
+            self.recheck_failed_files()
+            self.check_pending_files()
+            
+            # Sleep to avoid high CPU usage
+            time.sleep(1)
+    
+    def run_inotify(self, notifier):
+        """Event-driven loop: files are picked up as soon as they are closed or moved in"""
+        watches = {}  # wd -> source folder
+        
+        while self.running:
+            if self.on_pass:
+                self.on_pass()
+            
+            # Keep the kernel watches in step with the active profiles. New
+            # watches get one full scan to pick up files that already exist.
+            folders = self.profiles_by_folder()
+            for wd, folder in list(watches.items()):
+                if folder not in folders:
+                    notifier.remove_watch(wd)
+                    del watches[wd]
+            for folder in set(folders) - set(watches.values()):
+                if not os.path.isdir(folder):
+                    continue
+                try:
+                    watches[notifier.add_watch(folder, WATCH_EVENTS)] = folder
+                except OSError as e:
+                    print(f"Could not watch {folder}: {e}")
+                    continue
+                self.scan_folder(folder, folders[folder])
+            
+            if self.rescan_requested:
+                self.rescan_requested = False
+                for folder in set(watches.values()):
+                    self.scan_folder(folder, folders.get(folder, []))
+            
+            # Wake up more often while files are waiting for their writes to finish
+            timeout = STABILITY_INTERVAL / 2 if self.pending_files else 1.0
+            for wd, mask, name in notifier.read_events(timeout=timeout):
+                if not self.running:
+                    break
+                
+                if mask & inotify.IN_Q_OVERFLOW:
+                    # Events were dropped; rescan everything we watch
+                    for folder in set(watches.values()):
+                        self.scan_folder(folder, folders.get(folder, []))
+                    continue
+                
+                if mask & inotify.IN_IGNORED:
+                    # Folder was deleted or unmounted; re-added once it is back
+                    watches.pop(wd, None)
+                    continue
+                
+                folder = watches.get(wd)
+                if folder is None or not name or mask & inotify.IN_ISDIR:
+                    continue
+                
+                # Close-after-write and move-in events mean the file is complete
+                self.handle_file(os.path.join(folder, name), folders.get(folder, []), complete=True)
+            
+            self.check_pending_files()
+    
+    def folder_changed(self, source_folder, profile_ids):
+        """Polling helper: only folders whose mtime moved since the last scan need listing"""
+        try:
+            mtime_ns = os.stat(source_folder).st_mtime_ns
+        except OSError:
+            return False
+        
+        # Keyed by the profile set too, so a profile added on a known folder gets a scan
+        key = (source_folder, frozenset(profile_ids))
+        previous = self.folder_mtimes.get(key)
+        self.folder_mtimes[key] = mtime_ns
+        return previous != mtime_ns or time.time_ns() - mtime_ns < FOLDER_MTIME_GRACE_NS
+    
+    def scan_folder(self, source_folder, profile_ids):
+        if not profile_ids or not os.path.exists(source_folder):
+            return
+        
+        try:
+            with os.scandir(source_folder) as entries:
+                for entry in entries:
+                    if not self.running:
+                        break
+                    
+                    # Skip directories; d_type avoids a stat per entry on most filesystems
+                    if not entry.is_file():
+                        continue
+                    
+                    self.handle_file(entry.path, profile_ids)
+        except OSError as e:
+            print(f"Error scanning {source_folder}: {e}")
+    
+    def handle_file(self, file_path, profile_ids, complete=False):
+        """Queue a candidate file for conversion by the given profiles.
+
+        Files reported complete by the kernel are emitted straight away. Files
+        found by scanning may still be being copied, so they wait in
+        pending_files until check_pending_files() sees them stop changing.
+        """
+        # Check file extension
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext not in IMAGE_EXTENSIONS:
+            return
+        
+        if complete:
+            # A finished write may have replaced a file that failed to convert
+            with self.state_lock:
+                for pid in profile_ids:
+                    self.failed.pop((file_path, pid), None)
+        else:
+            self.forget_changed_failures(file_path, profile_ids)
+        
+        # Only profiles that have not processed it yet
+        profile_ids = [pid for pid in profile_ids if not self.is_known(file_path, pid)]
+        if not profile_ids:
+            return
+        
+        if complete:
+            self.pending_files.pop(file_path, None)
+            self.emit_file(file_path, profile_ids)
+        elif file_path in self.pending_files:
+            self.pending_files[file_path][3].update(profile_ids)
+        else:
+            stat = self.stat_file(file_path)
+            if stat:
+                self.pending_files[file_path] = [stat[0], stat[1], 0, set(profile_ids)]
+    
+    def forget_changed_failures(self, file_path, profile_ids):
+        """Drop failures of file_path recorded before its size or mtime last changed"""
+        with self.state_lock:
+            keys = [(file_path, pid) for pid in profile_ids if (file_path, pid) in self.failed]
+        if not keys:
+            return
+        stat = self.stat_file(file_path)
+        if stat is None:
+            return
+        with self.state_lock:
+            for key in keys:
+                if key in self.failed and self.failed[key] != stat:
+                    del self.failed[key]
+    
+    def recheck_failed_files(self):
+        """Polling helper: files rewritten in place leave the folder mtime alone, so check failed files directly"""
+        with self.state_lock:
+            failed = {}
+            for file_path, profile_id in self.failed:
+                if profile_id in self.profiles:
+                    failed.setdefault(file_path, []).append(profile_id)
+        for file_path, profile_ids in failed.items():
+            self.handle_file(file_path, profile_ids)
+    
+    def check_pending_files(self):
+        """Emit pending files whose size and mtime have settled"""
+        now = time.monotonic()
+        if not self.pending_files or now - self.last_pending_check < STABILITY_INTERVAL:
+            return
+        self.last_pending_check = now
+        
+        for file_path, state in list(self.pending_files.items()):
+            if not self.running:
+                break
+            
+            stat = self.stat_file(file_path)
+            # Drop profiles deactivated or converted via a close-write event meanwhile
+            profile_ids = [
+                pid for pid in state[3]
+                if pid in self.profiles and not self.is_known(file_path, pid)
+            ]
+            if stat is None or not profile_ids:
+                del self.pending_files[file_path]
+                continue
+            
+            size, mtime_ns = stat
+            if size > 0 and size == state[0] and mtime_ns == state[1]:
+                state[2] += 1
+            else:
+                self.pending_files[file_path] = [size, mtime_ns, 0, state[3]]
+                continue
+            
+            if state[2] >= self.stability_checks:
+                del self.pending_files[file_path]
+                self.emit_file(file_path, profile_ids)
+    
+    def stat_file(self, file_path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+    
+    def emit_file(self, file_path, profile_ids):
+        with self.state_lock:
+            self.in_flight.update((file_path, pid) for pid in profile_ids)
+        for profile_id in profile_ids:
+            self.seen_index.add(profile_id, file_path, self.thread_db)
+        
+        # Hand the file over for processing, once for all its profiles
+        if self.on_file:
+            self.on_file(file_path, list(profile_ids))
+    
+    def stop(self):
+        # The run loop closes its database connection when it exits
+        self.running = False
\ No newline at end of file